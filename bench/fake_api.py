@@ -0,0 +1,191 @@
+import json
+import time
+import typing
+import asyncio
+import itertools
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0, max_poll_wait: float = 1):
+        self._latency = latency
+        self._max_poll_wait = max_poll_wait
+        self._updates: typing.List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._chat_events: typing.Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+        self._runner: web.AppRunner | None = None
+        self.sent: typing.Dict[int, typing.List[dict]] = defaultdict(list)
+        self.calls = Counter()
+        self.methods = {
+            "getMe": self._get_me,
+            "deleteWebhook": self._true,
+            "getUpdates": self._get_updates,
+            "sendMessage": self._send_message,
+            "sendPhoto": self._send_photo,
+            "sendDocument": self._send_document,
+            "editMessageText": self._true,
+            "editMessageReplyMarkup": self._true,
+            "answerCallbackQuery": self._true,
+        }
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def push_message(self, user_id: int, text: str) -> int:
+        return self._push(
+            "message",
+            {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        )
+
+    def push_callback(self, user_id: int, data: str, message: dict) -> int:
+        return self._push(
+            "callback_query",
+            {
+                "id": str(next(self._callback_ids)),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "message": message,
+                "data": data,
+            },
+        )
+
+    async def wait_for(
+        self,
+        chat_id: int,
+        predicate: typing.Callable[[dict], bool],
+        start: int = 0,
+        timeout: float = 30,
+    ) -> typing.Tuple[int, dict]:
+        deadline = time.monotonic() + timeout
+        position = start
+        event = self._chat_events[chat_id]
+        while True:
+            messages = self.sent[chat_id]
+            while position < len(messages):
+                position += 1
+                if predicate(messages[position - 1]):
+                    return position, messages[position - 1]
+            event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"no matching reply in chat {chat_id}")
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def _push(self, kind: str, payload: dict) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, kind: payload})
+        self._new_updates.set()
+        return update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        handler = self.methods.get(method)
+        if handler is None:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found"},
+                status=404,
+            )
+        params = dict(await request.post())
+        if self._latency and method != "getUpdates":
+            await asyncio.sleep(self._latency)
+        return web.json_response({"ok": True, "result": await handler(params)})
+
+    async def _true(self, params: dict) -> bool:
+        return True
+
+    async def _get_me(self, params: dict) -> dict:
+        return BOT_USER
+
+    async def _get_updates(self, params: dict) -> typing.List[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = min(float(params.get("timeout") or 0), self._max_poll_wait)
+        self._updates = [
+            update for update in self._updates if update["update_id"] >= offset
+        ]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _send_message(self, params: dict) -> dict:
+        return self._record(params, text=params.get("text", ""))
+
+    async def _send_photo(self, params: dict) -> dict:
+        return self._record(
+            params,
+            caption=params.get("caption", ""),
+            photo=[self._file(params.get("photo"), width=1, height=1)],
+        )
+
+    async def _send_document(self, params: dict) -> dict:
+        return self._record(
+            params,
+            caption=params.get("caption", ""),
+            document=self._file(params.get("document")),
+        )
+
+    def _file(self, value: typing.Any, **fields) -> dict:
+        file_id = value if isinstance(value, str) else f"file{next(self._file_ids)}"
+        return dict(fields, file_id=file_id, file_unique_id=file_id)
+
+    def _record(self, params: dict, **content) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **content,
+        }
+        reply_markup = json.loads(params.get("reply_markup") or "null")
+        if reply_markup and "inline_keyboard" in reply_markup:
+            message["reply_markup"] = reply_markup
+        self.sent[chat_id].append(message)
+        self._chat_events[chat_id].set()
+        return message
@@ -0,0 +1,321 @@
+import json
+import time
+import typing
+import asyncio
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bench.fake_api import FakeBotAPI
+from bot.bot import TG_Bot
+from bot.media import MediaRegistry
+from db.db import make_db
+from db.storage import User
+from main import init_db, make_rate_provider
+from utils.metrics import LatencyHistogram
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_ID = 9_000_000_000_000
+
+
+class CompletionMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self._waiters: typing.Dict[int, asyncio.Future] = {}
+
+    def expect(self, update_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[update_id] = future
+        return future
+
+    async def on_post_process_update(self, update, results: list, data: dict):
+        future = self._waiters.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+class Recorder:
+    def __init__(self):
+        self.steps: typing.Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.flows: typing.Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.errors = Counter()
+        self.updates = 0
+        self.users_completed = 0
+
+    def report(self, duration: float, api: FakeBotAPI) -> dict:
+        flows_completed = sum(flow.count for flow in self.flows.values())
+        return {
+            "duration": duration,
+            "updates": self.updates,
+            "users_completed": self.users_completed,
+            "errors": dict(self.errors),
+            "throughput": {
+                "updates_per_second": self.updates / duration,
+                "flows_per_second": flows_completed / duration,
+                "users_per_second": self.users_completed / duration,
+            },
+            "steps": {name: hist.summary() for name, hist in self.steps.items()},
+            "flows": {name: hist.summary() for name, hist in self.flows.items()},
+            "api_calls": dict(api.calls),
+        }
+
+
+class Session:
+    def __init__(
+        self,
+        api: FakeBotAPI,
+        completion: CompletionMiddleware,
+        recorder: Recorder,
+        user_id: int,
+        timeout: float,
+    ):
+        self._api = api
+        self._completion = completion
+        self._timeout = timeout
+        self._position = 0
+        self.recorder = recorder
+        self.user_id = user_id
+        self.last_reply: dict | None = None
+
+    async def message(self, step: str, text: str, expect: str) -> dict:
+        return await self._step(
+            step, self._api.push_message(self.user_id, text), expect
+        )
+
+    async def callback(self, step: str, data: str, expect: str) -> dict:
+        update_id = self._api.push_callback(self.user_id, data, self.last_reply)
+        return await self._step(step, update_id, expect)
+
+    async def wait_notification(self, step: str, chat_id: int, expect: str):
+        started_at = time.perf_counter()
+        try:
+            await self._api.wait_for(
+                chat_id,
+                lambda message: expect in message.get("text", ""),
+                timeout=self._timeout,
+            )
+        except asyncio.TimeoutError:
+            self.recorder.errors[step] += 1
+            raise
+        self.recorder.steps[step].observe(time.perf_counter() - started_at)
+
+    async def _step(self, step: str, update_id: int, expect: str) -> dict:
+        started_at = time.perf_counter()
+        processed = self._completion.expect(update_id)
+        self.recorder.updates += 1
+        try:
+            await asyncio.wait_for(processed, self._timeout)
+            self._position, self.last_reply = await self._api.wait_for(
+                self.user_id,
+                lambda message: expect
+                in (message.get("text") or message.get("caption") or ""),
+                self._position,
+                self._timeout,
+            )
+        except asyncio.TimeoutError:
+            self.recorder.errors[step] += 1
+            raise
+        self.recorder.steps[step].observe(time.perf_counter() - started_at)
+        return self.last_reply
+
+
+async def flow(recorder: Recorder, name: str, steps: typing.Awaitable):
+    started_at = time.perf_counter()
+    await steps
+    recorder.flows[name].observe(time.perf_counter() - started_at)
+
+
+async def shop(session: Session, admin_id: int, items: int):
+    async def start():
+        await session.message("start", "/start", "Меню")
+
+    async def registration():
+        await session.callback("registration", "registration", "1/3")
+        await session.message("client_name", "Bench User", "2/3")
+        await session.message("client_phone", "+70000000000", "3/3")
+        await session.message("client_address", "Moscow", "✅ Вы успешно заполнили")
+
+    async def add_product(number: int):
+        await session.callback("add_product", "add_product", "👀 Выберите тип")
+        await session.callback("order_type", "type sneakers", "Пришлите ссылку")
+        await session.message(
+            "product_link", f"https://dw4.co/t/A/bench{number}", "Введите нужный размер"
+        )
+        await session.message("product_size", "42", "Введите стоимость")
+        await session.message("product_price", "799", "✅ Вы успешно добавили")
+
+    async def cart():
+        await session.callback("cart", "cart", "Ваша корзина")
+
+    async def checkout():
+        await session.callback("send_order", "send_order", "Убедитесь")
+        await session.message("confirm", "✅ Подтверждаю", "Оператор уже работает")
+        await session.wait_notification(
+            "order_notification", admin_id, f"C id: {session.user_id}\n"
+        )
+
+    recorder = session.recorder
+    await flow(recorder, "start", start())
+    await flow(recorder, "registration", registration())
+    for number in range(items):
+        await flow(recorder, "add_product", add_product(number))
+    await flow(recorder, "cart", cart())
+    await flow(recorder, "checkout", checkout())
+    recorder.users_completed += 1
+
+
+async def cleanup(base_id: int):
+    db = make_db()
+    await db.init()
+    try:
+        await db.execute(
+            "DELETE FROM outbox WHERE (payload->'user'->>'id')::BIGINT >= $1", base_id
+        )
+        await db.execute("DELETE FROM fsm_states WHERE chat_id >= $1", base_id)
+        await db.execute("DELETE FROM order_history WHERE buyer_id >= $1", base_id)
+        await db.execute(
+            "DELETE FROM bonus_ledger WHERE inviter_id >= $1 OR buyer_id >= $1",
+            base_id,
+        )
+        await db.execute("DELETE FROM users WHERE id >= $1", base_id)
+        await db.execute("DELETE FROM media_files")
+        await db.execute("DELETE FROM exchange_rates")
+    finally:
+        await db.close()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    Config.DATABASE = args.database
+    Config.ADMIN_IDS = []
+    api = FakeBotAPI(latency=args.api_latency)
+    Config.TELEGRAM_API_SERVER = await api.start()
+    Config.RUN_MODE = "polling"
+    Config.METRICS_PORT = None
+    Config.STATIC_YUAN_RATE = getattr(Config, "STATIC_YUAN_RATE", None) or 12.5
+    Config.TG_GLOBAL_RATE = args.global_rate
+    Config.TG_CHAT_RATE = args.chat_rate
+    Config.ANTIFLOOD_RATE = args.antiflood_rate
+    Config.ANTIFLOOD_BURST = args.antiflood_rate
+    (
+        db,
+        user_storage,
+        order_storage,
+        fsm_storage,
+        rate_storage,
+        media_storage,
+        broadcast_storage,
+        bonus_storage,
+        stats_storage,
+        outbox_storage,
+        order_history_storage,
+    ) = await init_db()
+    tg_bot = TG_Bot(
+        user_storage,
+        order_storage,
+        make_rate_provider(rate_storage),
+        MediaRegistry(media_storage, getattr(Config, "STATIC_DIR", "static")),
+        broadcast_storage,
+        bonus_storage,
+        stats_storage,
+        outbox_storage,
+        order_history_storage,
+        fsm_storage,
+    )
+    await cleanup(args.base_id)
+    admin_id = args.base_id
+    await user_storage.create(User(id=admin_id, role=User.ADMIN))
+    await tg_bot.init()
+    completion = CompletionMiddleware()
+    tg_bot.dispatcher.middleware.setup(completion)
+    polling = asyncio.create_task(tg_bot.start())
+    await tg_bot.wait_ready()
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user_id: int):
+        async with semaphore:
+            session = Session(api, completion, recorder, user_id, args.timeout)
+            try:
+                await shop(session, admin_id, args.items)
+            except asyncio.TimeoutError:
+                logger.warning("User %s timed out", user_id)
+
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(simulate(args.base_id + number) for number in range(1, args.users + 1))
+        )
+        duration = time.perf_counter() - started_at
+    finally:
+        await tg_bot.stop()
+        await asyncio.gather(polling, return_exceptions=True)
+        await db.close()
+        await api.stop()
+        if not args.keep_data:
+            await cleanup(args.base_id)
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "items": args.items,
+            "api_latency": args.api_latency,
+            "global_rate": args.global_rate,
+            "chat_rate": args.chat_rate,
+        },
+        **recorder.report(duration, api),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive simulated shoppers through the bot against a fake Bot API"
+    )
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--items", type=int, default=2)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--global-rate", type=float, default=10000)
+    parser.add_argument("--chat-rate", type=float, default=1000)
+    parser.add_argument("--antiflood-rate", type=float, default=1000)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--base-id", type=int, default=DEFAULT_BASE_ID)
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--output", default="bench-report.json")
+    parser.add_argument(
+        "--database",
+        default=Config.DATABASE,
+        help="dedicated benchmark database, its name must contain 'bench'",
+    )
+    args = parser.parse_args()
+    if "bench" not in args.database:
+        parser.error(
+            f"refusing to run against {args.database!r}: the benchmark overwrites "
+            "cached file_ids and the exchange rate, pass a dedicated --database "
+            "whose name contains 'bench'"
+        )
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    for name, summary in report["flows"].items():
+        print(
+            f"{name:<14} n={summary['count']:<6} p50={summary['p50'] * 1000:.1f}ms "
+            f"p99={summary['p99'] * 1000:.1f}ms"
+        )
+    print(
+        f"{report['updates']} updates in {report['duration']:.1f}s "
+        f"({report['throughput']['updates_per_second']:.0f}/s), "
+        f"errors: {sum(report['errors'].values())}, report: {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
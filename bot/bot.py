@@ -1,12 +1,19 @@
+import os
 import typing
+import logging
+import functools
+import tempfile
+from datetime import datetime, timedelta, timezone
 
 import aiogram
-import aiohttp
 import asyncio
-import aiofiles
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
 from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.utils.exceptions import MessageNotModified
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH, safe_split_text
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -15,7 +22,43 @@ from aiogram.types import (
 )
 
 from config import Config
-from db.storage import UserStorage, User, OrderStorage, Order
+from bot.broadcast import Broadcaster
+from bot.media import MediaRegistry
+from bot.middlewares import (
+    AntiFloodMiddleware,
+    FSMFlushMiddleware,
+    ReadinessMiddleware,
+)
+from bot.outbox import OutboxWorker
+from bot.sender import OutboundDispatcher, ThrottledBot
+from bot.webhook import WebhookServer
+from db.storage import (
+    UserStorage,
+    CachedUserStorage,
+    User,
+    OrderStorage,
+    Order,
+    FSMStorage,
+    BroadcastStorage,
+    Bonus,
+    BonusStorage,
+    StatsStorage,
+    OutboxEvent,
+    OutboxStorage,
+    OrderHistoryStorage,
+)
+from utils.export import export_to_file
+from utils.metrics import METRICS
+from utils.pricing import Pricing
+from utils.profiling import HandlerMetrics, Profiler
+from utils.rates import RateProvider
+from utils.startup import Startup
+
+logger = logging.getLogger(__name__)
+
+CART_PAGE_SIZE = 5
+ORDER_PREVIEW_SIZE = 10
+ORDER_PREVIEW_RESERVE = 100
 
 
 class GetUserInfo(StatesGroup):
@@ -35,57 +78,254 @@ class GetOrderSendingConfirm(StatesGroup):
 
 
 class TG_Bot:
-    def __init__(self, user_storage: UserStorage, order_storage: OrderStorage):
+    def __init__(
+        self,
+        user_storage: UserStorage,
+        order_storage: OrderStorage,
+        rate_provider: RateProvider,
+        media: MediaRegistry,
+        broadcast_storage: BroadcastStorage,
+        bonus_storage: BonusStorage,
+        stats_storage: StatsStorage,
+        outbox_storage: OutboxStorage,
+        order_history_storage: OrderHistoryStorage,
+        fsm_storage: BaseStorage | None = None,
+    ):
         self._user_storage: UserStorage = user_storage
         self._order_storage: OrderStorage = order_storage
-        self._bot: aiogram.Bot = aiogram.Bot(token=Config.TGBOT_API_KEY)
-        self._storage: MemoryStorage = MemoryStorage()
+        self._bonus_storage: BonusStorage = bonus_storage
+        self._stats_storage: StatsStorage = stats_storage
+        self._order_history_storage: OrderHistoryStorage = order_history_storage
+        self._rate_provider: RateProvider = rate_provider
+        self._media: MediaRegistry = media
+        self._pricing = Pricing(
+            commission=getattr(Config, "PRICE_COMMISSION", 0.05),
+            markup=getattr(Config, "PRICE_MARKUP", 0.05),
+            fixed_fee=getattr(Config, "PRICE_FIXED_FEE", 1000),
+            referral_share=getattr(Config, "REFERRAL_SHARE", 0.2),
+        )
+        self._outbound = OutboundDispatcher(
+            global_rate=getattr(Config, "TG_GLOBAL_RATE", 30),
+            chat_rate=getattr(Config, "TG_CHAT_RATE", 1),
+            concurrency=getattr(Config, "TG_SEND_CONCURRENCY", 8),
+        )
+        api_server = TELEGRAM_PRODUCTION
+        if getattr(Config, "TELEGRAM_API_SERVER", None):
+            api_server = TelegramAPIServer.from_base(Config.TELEGRAM_API_SERVER)
+        self._bot: aiogram.Bot = ThrottledBot(
+            token=Config.TGBOT_API_KEY, outbound=self._outbound, server=api_server
+        )
+        self._broadcaster = Broadcaster(
+            self._bot,
+            broadcast_storage,
+            rate=getattr(Config, "BROADCAST_RATE", 20),
+            concurrency=getattr(Config, "BROADCAST_CONCURRENCY", 8),
+            batch_size=getattr(Config, "BROADCAST_BATCH_SIZE", 100),
+            on_unreachable=self._forget_users,
+        )
+        self._outbox = OutboxWorker(
+            self._bot,
+            outbox_storage,
+            user_storage,
+            bonus_storage,
+            admin_ids=getattr(Config, "ADMIN_IDS", [6632311175]),
+            poll_interval=getattr(Config, "OUTBOX_POLL_INTERVAL", 1),
+        )
+        self._storage: BaseStorage = fsm_storage or MemoryStorage()
         self._dispatcher: aiogram.Dispatcher = aiogram.Dispatcher(
             self._bot, storage=self._storage
         )
-        self._yuan_rate = None
-        self._photo = None
+        self._scheduler: AsyncIOScheduler | None = None
+        self._startup: Startup | None = None
+        self._primary = True
+        self._warm_up_task: asyncio.Task | None = None
+        self._background_warm_up_task: asyncio.Task | None = None
+        self._handler_metrics = HandlerMetrics()
+        self._profiler = Profiler()
         self._create_keyboards()
 
-    async def init(self):
-        await self._get_last_rate()
-        scheduler = AsyncIOScheduler()
-        scheduler.add_job(self._get_last_rate, "interval", minutes=1)
-        scheduler.start()
+    async def init(self, startup: Startup | None = None, primary: bool = True):
+        self._startup = startup or Startup()
+        self._primary = primary
+        await self._outbound.start()
+        self._scheduler = AsyncIOScheduler()
+        self._scheduler.add_job(self._rate_provider.refresh, "interval", minutes=1)
+        if primary:
+            self._scheduler.add_job(
+                self._pay_out_bonuses,
+                "interval",
+                seconds=getattr(Config, "BONUS_PAYOUT_INTERVAL", 60),
+            )
+            self._scheduler.add_job(
+                self._order_history_storage.ensure_partitions, "interval", days=1
+            )
+            self._scheduler.add_job(
+                self._reconcile_bonuses,
+                "interval",
+                hours=1,
+                next_run_time=datetime.now(timezone.utc),
+            )
+        is_blocked = None
+        if isinstance(self._user_storage, CachedUserStorage):
+            self._scheduler.add_job(
+                self._user_storage.load_blocked,
+                "interval",
+                seconds=getattr(Config, "USER_CACHE_TTL", 300),
+            )
+            is_blocked = self._user_storage.is_blocked
+        self._dispatcher.middleware.setup(ReadinessMiddleware(self.wait_ready))
+        antiflood = AntiFloodMiddleware(
+            rate=getattr(Config, "ANTIFLOOD_RATE", 2),
+            burst=getattr(Config, "ANTIFLOOD_BURST", 10),
+            is_blocked=is_blocked,
+        )
+        self._dispatcher.middleware.setup(antiflood)
+        METRICS.register(
+            "telegram", self._outbound.render_metrics, self._outbound.report
+        )
+        METRICS.register(
+            "broadcast", self._broadcaster.render_metrics, self._broadcaster.report
+        )
+        METRICS.register("antiflood", antiflood.render_metrics, antiflood.report)
+        METRICS.register("outbox", self._outbox.render_metrics, self._outbox.report)
+        METRICS.register(
+            "handlers",
+            self._handler_metrics.render_metrics,
+            self._handler_metrics.report,
+        )
+        if isinstance(self._user_storage, CachedUserStorage):
+            METRICS.register(
+                "user_cache",
+                self._user_storage.render_metrics,
+                self._user_storage.report,
+            )
+        if isinstance(self._storage, FSMStorage):
+            self._dispatcher.middleware.setup(FSMFlushMiddleware(self._storage))
         self._init_handler()
+        self._warm_up_task = asyncio.create_task(self._warm_up())
+
+    async def wait_ready(self):
+        await asyncio.shield(self._warm_up_task)
 
     async def start(self):
         print("Bot has started")
-        await self._dispatcher.start_polling()
-
-    async def _get_last_rate(self):
-        rate = None
-        while not rate:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://www.cbr-xml-daily.ru/latest.js"
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json(
-                            content_type="application/javascript"
-                        )
-                        rate = 1 / data["rates"]["CNY"]
-            await asyncio.sleep(5)
-        self._yuan_rate = rate
+        receiving = asyncio.create_task(self._receive())
+        try:
+            await self.wait_ready()
+        except BaseException:
+            receiving.cancel()
+            raise
+        await receiving
 
-    async def _show_menu(self, message: aiogram.types.Message):
-        if not self._photo:
-            photo = aiogram.types.InputFile("logo.jpg")
+    async def _warm_up(self):
+        self._background_warm_up_task = asyncio.create_task(self._warm_up_background())
+        warm_ups = [self._startup.run("rate", self._rate_provider.init())]
+        if isinstance(self._user_storage, CachedUserStorage):
+            warm_ups.append(
+                self._startup.run("blocked_users", self._user_storage.load_blocked())
+            )
+        await asyncio.gather(*warm_ups)
+        self._scheduler.start()
+        self._startup.finish()
+
+    async def _warm_up_background(self):
+        warm_ups = [
+            self._run_optional("media", self._media.preload()),
+            self._run_optional("outbox", self._outbox.start()),
+        ]
+        if self._primary:
+            warm_ups.extend(
+                [
+                    self._run_optional(
+                        "order_history_partitions",
+                        self._order_history_storage.ensure_partitions(),
+                    ),
+                    self._run_optional("broadcasts", self._broadcaster.resume()),
+                ]
+            )
+        await asyncio.gather(*warm_ups)
+
+    async def _run_optional(self, name: str, awaitable: typing.Awaitable):
+        try:
+            await self._startup.run(name, awaitable)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Startup phase %s failed, continuing without it", name)
+
+    async def _receive(self):
+        if getattr(Config, "RUN_MODE", "polling") == "webhook":
+            await self._start_webhook()
         else:
-            photo = self._photo
-        sent_message = await message.answer_photo(
-            photo,
-            caption="Меню <a href='https://t.me/marequstore'>MAREQU Store</a>",
-            parse_mode="HTML",
-            reply_markup=self._inline_menu_keyboard,
-            # disable_web_page_preview=True,
+            if getattr(Config, "METRICS_PORT", None):
+                await METRICS.start_server(
+                    getattr(Config, "METRICS_HOST", "0.0.0.0"), Config.METRICS_PORT
+                )
+            await self._bot.delete_webhook()
+            await self._dispatcher.start_polling()
+
+    async def stop(self):
+        for task in (self._warm_up_task, self._background_warm_up_task):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if self._dispatcher.is_polling():
+            self._dispatcher.stop_polling()
+            await self._dispatcher.wait_closed()
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+        await self._broadcaster.stop()
+        await self._outbox.stop()
+        await self._outbound.stop()
+        await self._rate_provider.close()
+        await self._storage.close()
+        await self._storage.wait_closed()
+        session = await self._bot.get_session()
+        await session.close()
+
+    @property
+    def dispatcher(self) -> aiogram.Dispatcher:
+        return self._dispatcher
+
+    async def _start_webhook(self):
+        webhook_server = WebhookServer(
+            self._dispatcher,
+            path=getattr(Config, "WEBHOOK_PATH", "/webhook"),
+            secret=getattr(Config, "WEBHOOK_SECRET", None),
+            max_concurrency=getattr(Config, "WEBHOOK_MAX_CONCURRENCY", 256),
         )
-        self._photo = sent_message.photo[0].file_id
+        await webhook_server.start(
+            getattr(Config, "WEBAPP_HOST", "0.0.0.0"),
+            getattr(Config, "WEBAPP_PORT", 8080),
+            url=getattr(Config, "WEBHOOK_URL", None),
+        )
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await webhook_server.stop()
+
+    @property
+    def _yuan_rate(self) -> float:
+        return self._rate_provider.rate
+
+    async def _show_menu(self, message: aiogram.types.Message):
+        caption = "Меню <a href='https://t.me/marequstore'>MAREQU Store</a>"
+        if await self._media.has("logo.jpg"):
+            await self._media.answer_photo(
+                message,
+                "logo.jpg",
+                caption=caption,
+                parse_mode="HTML",
+                reply_markup=self._inline_menu_keyboard,
+                # disable_web_page_preview=True,
+            )
+        else:
+            await message.answer(
+                caption,
+                parse_mode="HTML",
+                reply_markup=self._inline_menu_keyboard,
+                disable_web_page_preview=True,
+            )
 
     async def _referal_system(self, call: aiogram.types.CallbackQuery):
         user = await self._user_storage.get_by_id(call.message.chat.id)
@@ -107,48 +347,128 @@ class TG_Bot:
             await call.message.answer("Вывод доступен от 1000 ₽ на балансе.")
 
     async def _show_cart(self, call: aiogram.types.CallbackQuery):
-        user_orders = await self._order_storage.get_orders_by_user_id(
-            call.message.chat.id
+        split_data = call.data.split()
+        if len(split_data) == 2 and split_data[1].isdigit():
+            await call.answer()
+            await self._render_cart(call.message, int(split_data[1]), edit=True)
+        else:
+            await self._render_cart(call.message, 0)
+
+    async def _render_cart(
+        self, message: aiogram.types.Message, page: int, edit: bool = False
+    ):
+        orders_amount, total_price_yuan = await self._order_storage.get_cart_totals(
+            message.chat.id
         )
-        if user_orders:
-            await call.message.answer(
-                "Проверьте, не забыли ли Вы ничего 🤔\n🛒 Ваша корзина:",
-                reply_markup=self._inline_cart_keyboard,
+        pages_amount = (orders_amount + CART_PAGE_SIZE - 1) // CART_PAGE_SIZE
+        page = min(page, max(pages_amount - 1, 0))
+        user_orders = []
+        if orders_amount:
+            user_orders, _ = await self._order_storage.get_orders_page(
+                message.chat.id, CART_PAGE_SIZE, page * CART_PAGE_SIZE
             )
-            for order in user_orders:
-                delete_keyboard = InlineKeyboardMarkup().row(
+        if not user_orders:
+            text, keyboard = "В вашей корзине нет ни одного товара", None
+        else:
+            yuan_rate = self._yuan_rate
+            quotes = self._pricing.quote_many(
+                [order.price for order in user_orders], yuan_rate
+            )
+            total_price_rub = self._pricing.total_rub(
+                orders_amount, total_price_yuan, yuan_rate
+            )
+            order_lines = []
+            keyboard = InlineKeyboardMarkup()
+            for number, (order, quote) in enumerate(
+                zip(user_orders, quotes), start=page * CART_PAGE_SIZE + 1
+            ):
+                order_lines.append(f"{number}. {order.custom_str(quote.rub)}")
+                keyboard.row(
                     InlineKeyboardButton(
-                        text="❌ Удалить", callback_data=f"delete_order {order.id}"
+                        text=f"❌ Удалить №{number}",
+                        callback_data=f"delete_order {order.id} {page}",
                     )
                 )
-                await call.message.answer(
-                    order.custom_str(self._yuan_rate),
-                    reply_markup=delete_keyboard,
+            if pages_amount > 1:
+                keyboard.row(
+                    InlineKeyboardButton(
+                        "⬅️", callback_data=f"cart {(page - 1) % pages_amount}"
+                    ),
+                    InlineKeyboardButton(
+                        f"{page + 1}/{pages_amount}", callback_data=f"cart {page}"
+                    ),
+                    InlineKeyboardButton(
+                        "➡️", callback_data=f"cart {(page + 1) % pages_amount}"
+                    ),
                 )
+            for row in self._inline_cart_keyboard.inline_keyboard:
+                keyboard.row(*row)
+            text = (
+                f"Проверьте, не забыли ли Вы ничего 🤔\n🛒 Ваша корзина ({orders_amount} шт.):\n\n"
+                + "\n\n".join(order_lines)
+                + f"\n\n💰 Итого: {total_price_rub} ₽"
+            )
+        if edit:
+            try:
+                await message.edit_text(
+                    text, reply_markup=keyboard, disable_web_page_preview=True
+                )
+            except MessageNotModified:
+                pass
         else:
-            await call.message.answer("В вашей корзине нет ни одного товара")
+            await message.answer(
+                text, reply_markup=keyboard, disable_web_page_preview=True
+            )
 
     async def _delete_product(self, call: aiogram.types.CallbackQuery):
-        order_id = int(call.data.split()[1])
+        split_data = call.data.split()
+        order_id = int(split_data[1])
+        page = int(split_data[2]) if len(split_data) > 2 else 0
         await self._order_storage.delete(order_id)
         await call.answer("✅ Вы успешно удалили товар")
-        await call.message.edit_text(
-            "<strike>" + call.message.text + "</strike>", parse_mode="HTML"
-        )
+        await self._render_cart(call.message, page, edit=True)
 
     async def _send_order(self, call: aiogram.types.CallbackQuery):
         user = await self._user_storage.get_by_id(call.message.chat.id)
         if user and user.full_name:
-            user_orders = await self._order_storage.get_orders_by_user_id(
-                call.message.chat.id
-            )
+            (
+                orders_amount,
+                total_price_yuan,
+            ) = await self._order_storage.get_cart_totals(call.message.chat.id)
+            user_orders = []
+            if orders_amount:
+                user_orders, _ = await self._order_storage.get_orders_page(
+                    call.message.chat.id, ORDER_PREVIEW_SIZE
+                )
             if user_orders:
+                yuan_rate = self._yuan_rate
+                quotes = self._pricing.quote_many(
+                    [order.price for order in user_orders], yuan_rate
+                )
+                total_price_rub = self._pricing.total_rub(
+                    orders_amount, total_price_yuan, yuan_rate
+                )
+                header = f"Убедитесь, что все данные верны 😊\n🛒 Ваш заказ ({orders_amount} шт.):\n\n"
+                footer = f"\n\n💰 Итого: {total_price_rub} ₽"
+                length = len(header) + len(footer) + ORDER_PREVIEW_RESERVE
+                order_lines = []
+                for number, (order, quote) in enumerate(
+                    zip(user_orders, quotes), start=1
+                ):
+                    line = f"{number}. {order.custom_str(quote.rub)}"
+                    length += len(line) + 2
+                    if length > MAX_MESSAGE_LENGTH:
+                        break
+                    order_lines.append(line)
+                if orders_amount > len(order_lines):
+                    order_lines.append(
+                        f"…и ещё {orders_amount - len(order_lines)} шт. — полный список в корзине"
+                    )
                 await call.message.answer(
-                    "Убедитесь, что все данные верны 😊\n🛒 Ваш заказ:",
+                    header + "\n\n".join(order_lines) + footer,
                     reply_markup=self._order_sending_keyboard,
+                    disable_web_page_preview=True,
                 )
-                for order in user_orders:
-                    await call.message.answer(order.custom_str(self._yuan_rate))
                 await GetOrderSendingConfirm.answer.set()
             else:
                 await call.message.answer(
@@ -165,56 +485,30 @@ class TG_Bot:
     async def _process_order_sending_answer(
         self, message: aiogram.types.Message, state: aiogram.dispatcher.FSMContext
     ):
-        user = await self._user_storage.get_by_id(message.from_user.id)
         if message.text.strip() == "✅ Подтверждаю":
-            await self._bot.send_message(
-                6632311175,
-                # 5546230210,
-                f"""❗️Новая заявка❗️\n\nПользователь <a href="tg://user?id={user.id}">{user.full_name}</a>\nC id: {user.id}\n\nНомер телефона: {user.phone}\n\nАдрес доставки: {user.address}""",
-                parse_mode="HTML",
+            user = await self._user_storage.get_by_id(message.from_user.id)
+            yuan_rate = self._yuan_rate
+            user_orders = await self._order_storage.checkout(
+                message.from_user.id,
+                self._pricing,
+                yuan_rate,
+                lambda orders: self._order_placed_event(user, orders, yuan_rate),
             )
-            user_orders = await self._order_storage.get_orders_by_user_id(
-                message.from_user.id
-            )
-            await self._bot.send_chat_action(
-                chat_id=message.from_user.id, action=aiogram.types.ChatActions.TYPING
-            )
-            total_price_yuan = 0
-            total_price_rub = 0
-            for order in user_orders:
-                rub_price = round(1.05 * 1.05 * order.price * self._yuan_rate + 1000)
-                give_bonuses_keyboard = None
-                if user.inviter_id:
-                    bonus_from_order = round(
-                        1.05 * 0.05 * order.price * self._yuan_rate * 0.2
-                    )
-                    give_bonuses_keyboard = InlineKeyboardMarkup().row(
-                        InlineKeyboardButton(
-                            "Выдать бонусы",
-                            callback_data=f"give_bonus {user.inviter_id} {bonus_from_order}",
-                        )
-                    )
-                await self._bot.send_message(
-                    6632311175,
-                    # 5546230210,
-                    order.custom_str(self._yuan_rate),
-                    reply_markup=give_bonuses_keyboard,
+            await state.finish()
+            if not user_orders:
+                await message.answer(
+                    "В вашей корзине нет ни одного товара",
+                    reply_markup=self._menu_keyboard_user,
                 )
-                total_price_yuan += order.price
-                total_price_rub += rub_price
-                await self._order_storage.delete(order.id)
-
-            total_profit = round(1.05 * 0.05 * total_price_yuan * self._yuan_rate)
-            await self._bot.send_message(
-                6632311175,
-                # 5546230210,
-                f"Приблизительная цена заказа в рублях: {total_price_rub} ₽\nПриблизительная прибыль заказа в рублях: {total_profit} ₽",
+                return
+            self._outbox.notify()
+            cart = self._pricing.quote_cart(
+                [order.price for order in user_orders], yuan_rate
             )
             await message.answer(
-                f"Оператор уже работает над заказом и скоро с Вами свяжется. Спасибо, что вы с нами ❤️\n\n💰Итоговая стоимость {total_price_rub} руб с доставкой до склада в Москве.\n\n🚚 Доставка СДЭКом от склада в Москве по России оплачивается отдельно",
+                f"Оператор уже работает над заказом и скоро с Вами свяжется. Спасибо, что вы с нами ❤️\n\n💰Итоговая стоимость {cart.rub} руб с доставкой до склада в Москве.\n\n🚚 Доставка СДЭКом от склада в Москве по России оплачивается отдельно",
                 reply_markup=self._menu_keyboard_user,
             )
-            await state.finish()
         elif message.text.strip() == "Назад":
             await state.finish()
             await self._show_menu(message=message)
@@ -223,18 +517,104 @@ class TG_Bot:
                 "Нет такого варианта ответа", reply_markup=self._order_sending_keyboard
             )
 
+    def _order_placed_event(
+        self, user: User, orders: typing.List[Order], yuan_rate: float
+    ) -> typing.Tuple[str, dict]:
+        cart = self._pricing.quote_cart([order.price for order in orders], yuan_rate)
+        return OutboxEvent.ORDER_PLACED, {
+            "user": {
+                "id": user.id,
+                "full_name": user.full_name,
+                "phone": user.phone,
+                "address": user.address,
+                "inviter_id": user.inviter_id,
+            },
+            "orders": [
+                {
+                    "id": order.id,
+                    "link": order.link,
+                    "size": order.size,
+                    "price": order.price,
+                    "rub": quote.rub,
+                    "bonus": quote.bonus,
+                }
+                for order, quote in zip(orders, cart.items)
+            ],
+            "yuan_rate": yuan_rate,
+            "rub": cart.rub,
+            "profit": cart.profit,
+        }
+
     async def _give_bonus(self, call: aiogram.types.CallbackQuery):
-        user_id, bonus = list(map(int, call.data.split()[1:]))
-        await call.message.edit_reply_markup()
-        await self._user_storage.give_bonus(user_id, bonus)
+        split_data = call.data.split()
+        bonus = None
+        if len(split_data) == 2 and split_data[1].isdigit():
+            bonus = await self._bonus_storage.approve(int(split_data[1]))
+        elif len(split_data) in (3, 4) and all(
+            part.isdigit() for part in split_data[1:]
+        ):
+            inviter_id, amount, *order_id = map(int, split_data[1:])
+            bonus = await self._bonus_storage.approve_legacy(
+                f"{call.message.chat.id} {call.message.message_id} {call.data}",
+                inviter_id,
+                amount,
+                order_id[0] if order_id else None,
+            )
+        remaining_keyboard = InlineKeyboardMarkup()
+        for row in call.message.reply_markup.inline_keyboard:
+            buttons = [button for button in row if button.callback_data != call.data]
+            if buttons:
+                remaining_keyboard.row(*buttons)
+        await call.message.edit_reply_markup(
+            remaining_keyboard if remaining_keyboard.inline_keyboard else None
+        )
+        if bonus is None:
+            await call.answer("Бонус уже выдан или кнопка устарела")
+            return
         await call.message.answer(
-            f"Успешно выдано <a href='tg://user?id={user_id}'>пользователю</a> {bonus} бонусов",
+            f"Успешно выдано <a href='tg://user?id={bonus.inviter_id}'>пользователю</a> {bonus.amount} бонусов",
             parse_mode="HTML",
         )
-        await self._bot.send_message(
-            user_id,
-            f"Поздравляем 🎉 \nВы получили {bonus} бонусов за заказ друга 🤝\nСпасибо, что советуете наш сервис друзьям ❤️\n1 бонус = 1 рубль\nВы можете потратить бонусы у нас или вывести их на свою карту 🙂\n\n( для уточнения деталей реферальной программы обратитесь к менеджеру )",
+
+    def _forget_users(self, user_ids: typing.List[int]):
+        if isinstance(self._user_storage, CachedUserStorage):
+            self._user_storage.invalidate(*user_ids)
+
+    async def _reconcile_bonuses(self):
+        bonuses = await self._bonus_storage.get_totals()
+        drift_count = await self._bonus_storage.get_drift_count()
+        await self._stats_storage.set_counters(
+            {
+                "bonuses_pending": bonuses.get(Bonus.PENDING, (0, 0))[1],
+                "bonuses_approved": bonuses.get(Bonus.APPROVED, (0, 0))[1],
+                "bonuses_paid": bonuses.get(Bonus.PAID, (0, 0))[1],
+                "balance_drift": drift_count,
+            }
         )
+        if drift_count:
+            drift = await self._bonus_storage.get_drift()
+            logger.warning(
+                "%s balances differ from the bonus ledger, first %s: %s",
+                drift_count,
+                len(drift),
+                ", ".join(
+                    f"{user_id} ({balance} vs {ledger})"
+                    for user_id, balance, ledger in drift
+                ),
+            )
+
+    async def _pay_out_bonuses(self):
+        payouts = await self._bonus_storage.pay_out()
+        if not payouts:
+            return
+        self._forget_users([user_id for user_id, _, _ in payouts])
+        for user_id, bonus, orders_amount in payouts:
+            self._outbound.fire(
+                self._bot.send_message(
+                    user_id,
+                    f"Поздравляем 🎉 \nВы получили {bonus} бонусов за заказы друзей ({orders_amount} шт.) 🤝\nСпасибо, что советуете наш сервис друзьям ❤️\n1 бонус = 1 рубль\nВы можете потратить бонусы у нас или вывести их на свою карту 🙂\n\n( для уточнения деталей реферальной программы обратитесь к менеджеру )",
+                )
+            )
 
     async def _ask_order_type(self, call: aiogram.types.CallbackQuery):
         await call.message.answer(
@@ -258,13 +638,13 @@ class TG_Bot:
         if product_type in ("onesize", "tech"):
             levels = "2"
         await state.update_data(levels=levels)
-        async with aiofiles.open("link.jpg", "rb") as link_pic:
-            await call.message.answer_photo(
-                link_pic,
-                f"<a href='https://telegra.ph/Kak-skachat-Poison-i-najti-tam-tovar-10-27'>Как заказать товар?</a> - ссылка\n1/{levels} Пришлите ссылку на товар по инструкции на картинке:",
-                # reply_markup=self._cancel_keyboard,
-                parse_mode="HTML",
-            )
+        await self._media.answer_photo(
+            call.message,
+            "link.jpg",
+            f"<a href='https://telegra.ph/Kak-skachat-Poison-i-najti-tam-tovar-10-27'>Как заказать товар?</a> - ссылка\n1/{levels} Пришлите ссылку на товар по инструкции на картинке:",
+            # reply_markup=self._cancel_keyboard,
+            parse_mode="HTML",
+        )
 
     async def _process_product_name(
         self, message: aiogram.types.Message, state: aiogram.dispatcher.FSMContext
@@ -272,12 +652,12 @@ class TG_Bot:
         state_data = await state.get_data()
         await state.update_data(product_link=message.text.strip())
         if state_data["product_type"] in ("onesize", "tech"):
-            async with aiofiles.open("pic.jpg", "rb") as picture:
-                await message.answer_photo(
-                    picture,
-                    f"2/{state_data['levels']} Введите стоимость товара в юанях (зачеркнутая цена):",
-                    # reply_markup=self._cancel_keyboard,
-                )
+            await self._media.answer_photo(
+                message,
+                "pic.jpg",
+                f"2/{state_data['levels']} Введите стоимость товара в юанях (зачеркнутая цена):",
+                # reply_markup=self._cancel_keyboard,
+            )
             await GetProductInfo.price.set()
         else:
             await message.answer(
@@ -291,12 +671,12 @@ class TG_Bot:
     ):
         state_data = await state.get_data()
         await state.update_data(product_size=message.text.strip())
-        async with aiofiles.open("pic.jpg", "rb") as picture:
-            await message.answer_photo(
-                picture,
-                f"3/{state_data['levels']} Введите стоимость товара в юанях (зачеркнутая цена):",
-                # reply_markup=self._cancel_keyboard,
-            )
+        await self._media.answer_photo(
+            message,
+            "pic.jpg",
+            f"3/{state_data['levels']} Введите стоимость товара в юанях (зачеркнутая цена):",
+            # reply_markup=self._cancel_keyboard,
+        )
         await GetProductInfo.price.set()
 
     async def _process_product_price(
@@ -317,7 +697,9 @@ class TG_Bot:
                 "✅ Вы успешно добавили новый товар в корзину:",
                 reply_markup=self._inline_menu_keyboard,
             )
-            await message.answer(order.custom_str(self._yuan_rate))
+            await message.answer(
+                order.custom_str(self._pricing.quote(order.price, self._yuan_rate).rub)
+            )
             await state.finish()
         else:
             await message.answer("Введите только число юаней(цифрами):")
@@ -353,12 +735,13 @@ class TG_Bot:
         self, message: aiogram.types.Message, state: aiogram.dispatcher.FSMContext
     ):
         state_data = await state.get_data()
-        db_user = await self._user_storage.get_by_id(message.from_user.id)
-        db_user.full_name = state_data["client_name"]
-        db_user.phone = state_data["client_phone"]
-        db_user.address = message.text.strip()
         await state.finish()
-        await self._user_storage.update(db_user)
+        await self._user_storage.update_contacts(
+            message.from_user.id,
+            state_data["client_name"],
+            state_data["client_phone"],
+            message.text.strip(),
+        )
         await message.answer(
             "✅ Вы успешно заполнили все необходимые данные, теперь вы можете добавлять товары в корзину и оформлять заказы.",
             reply_markup=self._inline_menu_keyboard,
@@ -375,7 +758,130 @@ class TG_Bot:
         )
         await self._show_menu(call.message)
 
+    async def _show_metrics(self, message: aiogram.types.Message):
+        for part in safe_split_text(METRICS.report() or "Нет данных"):
+            await message.answer(part)
+
+    async def _show_stats(self, message: aiogram.types.Message):
+        counters = await self._stats_storage.get_counters()
+        await message.answer(
+            f"📊 Статистика\n\n"
+            f"Пользователей: {counters.get('users_total', 0)}\n"
+            f"Зарегистрировано: {counters.get('users_registered', 0)}\n"
+            f"Заблокировано: {counters.get('users_blocked', 0)}\n"
+            f"Приглашено друзьями: {counters.get('referrals', 0)}\n"
+            f"Товаров в корзинах: {counters.get('orders_open', 0)}\n\n"
+            f"Бонусы к выдаче: {counters.get('bonuses_pending', 0)} ₽\n"
+            f"Бонусы одобрены: {counters.get('bonuses_approved', 0)} ₽\n"
+            f"Бонусы выплачены: {counters.get('bonuses_paid', 0)} ₽\n"
+            f"Балансы расходятся с журналом: {counters.get('balance_drift', 0)}\n"
+            f"(бонусы пересчитываются раз в час)"
+        )
+
+    async def _show_revenue(self, message: aiogram.types.Message):
+        args = message.get_args().split()
+        months = int(args[0]) if args and args[0].isdigit() else 6
+        now = datetime.now(timezone.utc)
+        since = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+        for _ in range(max(months, 1) - 1):
+            since = (since - timedelta(days=1)).replace(day=1)
+        revenue = await self._order_history_storage.get_monthly_revenue(since)
+        if not revenue:
+            await message.answer("Продаж за этот период нет")
+            return
+        lines = [
+            f"{month:%m.%Y}: {orders_amount} шт., {rub} ₽, прибыль {profit} ₽"
+            for month, orders_amount, rub, profit in revenue
+        ]
+        await message.answer("📈 Выручка по месяцам\n\n" + "\n".join(lines))
+
+    async def _export_table(self, message: aiogram.types.Message):
+        storages = {"users": self._user_storage, "orders": self._order_storage}
+        args = message.get_args().split()
+        if not args or args[0] not in storages:
+            await message.answer("Использование: /export users|orders [gz]")
+            return
+        compress = "gz" in args[1:]
+        filename = f"{args[0]}.csv.gz" if compress else f"{args[0]}.csv"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            rows = await export_to_file(storages[args[0]].export_csv, path, compress)
+            with open(path, "rb") as file:
+                await message.answer_document(
+                    aiogram.types.InputFile(file, filename=filename),
+                    caption=f"Выгружено строк: {rows}",
+                )
+
+    async def _start_profile(self, message: aiogram.types.Message):
+        args = message.get_args().split()
+        seconds = int(args[0]) if args and args[0].isdigit() else 30
+        sort = args[1] if len(args) > 1 else "tottime"
+        if sort not in Profiler.SORT_KEYS:
+            await message.answer(
+                f"Использование: /profile [секунды] [{'|'.join(Profiler.SORT_KEYS)}]"
+            )
+            return
+        if self._profiler.running:
+            await message.answer("Профилирование уже запущено")
+            return
+        seconds = min(max(seconds, 1), self._profiler.max_seconds)
+        await message.answer(f"⏱ Профилирование на {seconds} с запущено")
+        self._outbound.fire(self._send_profile(message, seconds, sort))
+
+    async def _send_profile(
+        self, message: aiogram.types.Message, seconds: int, sort: str
+    ):
+        report = await self._profiler.capture(seconds, sort)
+        for part in safe_split_text(report or "Нет данных"):
+            await message.answer(part)
+
+    async def _start_broadcast(self, message: aiogram.types.Message):
+        parts = message.html_text.split(maxsplit=1)
+        if len(parts) < 2:
+            await message.answer("Использование: /broadcast текст рассылки")
+            return
+        broadcast = await self._broadcaster.start(parts[1], message.from_user.id)
+        await message.answer(
+            f"📣 Рассылка #{broadcast.id} запущена. Остановить: /broadcast_cancel {broadcast.id}"
+        )
+
+    async def _cancel_broadcast(self, message: aiogram.types.Message):
+        args = message.get_args().split()
+        if not args or not args[0].isdigit():
+            running = ", ".join(map(str, self._broadcaster.running)) or "нет"
+            await message.answer(
+                f"Использование: /broadcast_cancel номер\nЗапущенные рассылки: {running}"
+            )
+            return
+        await self._broadcaster.cancel(int(args[0]))
+        await message.answer(f"Рассылка #{args[0]} остановлена")
+
     def _init_handler(self):
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._show_metrics), commands=["metrics"], state="*"
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._start_broadcast),
+            commands=["broadcast"],
+            state="*",
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._cancel_broadcast),
+            commands=["broadcast_cancel"],
+            state="*",
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._show_stats), commands=["stats"], state="*"
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._export_table), commands=["export"], state="*"
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._show_revenue), commands=["revenue"], state="*"
+        )
+        self._dispatcher.register_message_handler(
+            self._admin_required(self._start_profile), commands=["profile"], state="*"
+        )
         self._dispatcher.register_message_handler(
             self._user_middleware(self._show_menu),
             text="Меню",
@@ -456,43 +962,51 @@ class TG_Bot:
         self._dispatcher.register_message_handler(
             self._process_client_address, state=GetUserInfo.address
         )
+        for handlers in (
+            self._dispatcher.message_handlers,
+            self._dispatcher.callback_query_handlers,
+        ):
+            for handler_obj in handlers.handlers:
+                handler_obj.handler = self._handler_metrics.wrap(handler_obj.handler)
 
     def _user_middleware(self, func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
         async def wrapper(message: aiogram.types.Message, *args, **kwargs):
-            user = await self._user_storage.get_by_id(message.chat.id)
-            if user is None:
-                split_message = message.text.split()
-                if (
-                    len(split_message) == 2
-                    and split_message[1].isdigit()
-                    and await self._user_storage.get_by_id(int(split_message[1]))
-                ):
-                    inviter_id = int(split_message[1])
-                    await self._bot.send_message(
-                        chat_id=inviter_id, text="❤️ Спасибо за приглашённого друга."
-                    )
-                    user = User(
-                        id=message.chat.id, role=User.USER, inviter_id=inviter_id
+            split_message = message.text.split()
+            inviter_id = None
+            if len(split_message) == 2 and split_message[1].isdigit():
+                inviter_id = int(split_message[1])
+            user, is_new = await self._user_storage.bootstrap(
+                message.chat.id, inviter_id
+            )
+            if is_new:
+                if user.inviter_id:
+                    self._outbound.fire(
+                        self._bot.send_message(
+                            chat_id=user.inviter_id,
+                            text="❤️ Спасибо за приглашённого друга.",
+                        )
                     )
                     await message.answer("✅ Вы успешно установили своего пригласителя")
-                else:
-                    user = User(id=message.chat.id, role=User.USER)
                 await message.answer(
                     "Сейчас Вы не зарегестрированы, поэтому Оформление заказа Вам не доступно, пройдите регистрацию, нажав кнопку ниже:",
                     parse_mode="HTML",
                     reply_markup=self._inline_reg_keyboard,
                     # disable_web_page_preview=True,
                 )
-                await self._user_storage.create(user)
+            elif user.unreachable and message.text.startswith("/start"):
+                await self._user_storage.mark_reachable(user.id)
             if user.role != User.BLOCKED:
                 await func(message)
 
         return wrapper
 
     def _admin_required(self, func: typing.Callable) -> typing.Callable:
-        async def wrapper(message: aiogram.types.Message, user: User, *args, **kwargs):
-            if user.role == User.ADMIN:
-                await func(message, user)
+        @functools.wraps(func)
+        async def wrapper(message: aiogram.types.Message, *args, **kwargs):
+            user = await self._user_storage.get_by_id(message.from_user.id)
+            if user and user.role == User.ADMIN:
+                await func(message)
 
         return wrapper
 
@@ -0,0 +1,158 @@
+import typing
+import asyncio
+import logging
+
+import aiogram
+from aiogram.utils.exceptions import ChatNotFound, Unauthorized
+
+from db.storage import Broadcast, BroadcastStorage
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: aiogram.Bot,
+        storage: BroadcastStorage,
+        rate: float = 20,
+        concurrency: int = 8,
+        batch_size: int = 100,
+        on_unreachable: typing.Callable[[typing.List[int]], None] | None = None,
+    ):
+        self._bot = bot
+        self._storage = storage
+        self._on_unreachable = on_unreachable
+        self._bucket = TokenBucket(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._batch_size = batch_size
+        self._tasks: typing.Dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+
+    @property
+    def running(self) -> typing.List[int]:
+        return list(self._tasks)
+
+    async def resume(self):
+        for broadcast in await self._storage.get_running():
+            logger.info("Resuming broadcast %s", broadcast.id)
+            self._launch(broadcast)
+
+    async def start(self, text: str, created_by: int) -> Broadcast:
+        broadcast = await self._storage.create(text, created_by)
+        self._launch(broadcast)
+        return broadcast
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        task = self._tasks.pop(broadcast_id, None)
+        if task is not None:
+            task.cancel()
+        await self._storage.finish(broadcast_id, Broadcast.CANCELLED)
+        return task is not None
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def render_metrics(self) -> typing.List[str]:
+        return [
+            f"broadcast_running {len(self._tasks)}",
+            f'broadcast_deliveries_total{{status="{Broadcast.SENT}"}} {self.sent}',
+            f'broadcast_deliveries_total{{status="{Broadcast.FAILED}"}} {self.failed}',
+            f'broadcast_deliveries_total{{status="{Broadcast.UNREACHABLE}"}} {self.unreachable}',
+        ]
+
+    def report(self) -> str:
+        return (
+            f"Broadcasts: running {len(self._tasks)}, sent {self.sent}, "
+            f"failed {self.failed}, unreachable {self.unreachable}"
+        )
+
+    def _launch(self, broadcast: Broadcast):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast.id, None))
+
+    async def _run(self, broadcast: Broadcast):
+        after_id = 0
+        try:
+            while True:
+                user_ids = await self._storage.get_recipients(
+                    broadcast.id, after_id, self._batch_size
+                )
+                if not user_ids:
+                    break
+                deliveries = []
+                try:
+                    await asyncio.gather(
+                        *(
+                            self._deliver(broadcast, user_id, deliveries)
+                            for user_id in user_ids
+                        )
+                    )
+                finally:
+                    if deliveries:
+                        await self._storage.save_deliveries(broadcast.id, deliveries)
+                        self._notify_unreachable(deliveries)
+                after_id = user_ids[-1]
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(
+                "Broadcast %s stopped, will resume on restart", broadcast.id
+            )
+            return
+        await self._storage.finish(broadcast.id)
+        stats = await self._storage.get_stats(broadcast.id)
+        logger.info("Broadcast %s finished: %s", broadcast.id, stats)
+        try:
+            await self._bot.send_message(
+                broadcast.created_by,
+                f"📣 Рассылка #{broadcast.id} завершена\n"
+                f"Доставлено: {stats.get(Broadcast.SENT, 0)}\n"
+                f"Ошибки: {stats.get(Broadcast.FAILED, 0)}\n"
+                f"Заблокировали бота: {stats.get(Broadcast.UNREACHABLE, 0)}",
+            )
+        except Exception:
+            logger.exception("Failed to report broadcast %s", broadcast.id)
+
+    def _notify_unreachable(
+        self, deliveries: typing.List[typing.Tuple[int, str, str | None]]
+    ):
+        if self._on_unreachable is None:
+            return
+        user_ids = [
+            user_id
+            for user_id, status, _ in deliveries
+            if status == Broadcast.UNREACHABLE
+        ]
+        if user_ids:
+            self._on_unreachable(user_ids)
+
+    async def _deliver(
+        self,
+        broadcast: Broadcast,
+        user_id: int,
+        deliveries: typing.List[typing.Tuple[int, str, str | None]],
+    ):
+        async with self._semaphore:
+            await self._bucket.acquire()
+            try:
+                await self._bot.send_message(user_id, broadcast.text, parse_mode="HTML")
+            except (Unauthorized, ChatNotFound) as e:
+                self.unreachable += 1
+                deliveries.append((user_id, Broadcast.UNREACHABLE, str(e)))
+            except Exception as e:
+                self.failed += 1
+                logger.warning(
+                    "Broadcast %s to %s failed: %s", broadcast.id, user_id, e
+                )
+                deliveries.append((user_id, Broadcast.FAILED, str(e)))
+            else:
+                self.sent += 1
+                deliveries.append((user_id, Broadcast.SENT, None))
@@ -0,0 +1,97 @@
+import io
+import os
+import typing
+import asyncio
+import hashlib
+import logging
+
+import aiogram
+from aiogram.utils.exceptions import (
+    TypeOfFileMismatch,
+    WrongFileIdentifier,
+    WrongRemoteFileIdSpecified,
+)
+
+from db.storage import MediaStorage
+
+logger = logging.getLogger(__name__)
+
+
+class MediaRegistry:
+    def __init__(self, storage: MediaStorage, static_dir: str = "static"):
+        self._storage = storage
+        self._static_dir = static_dir
+        self._files: typing.Dict[str, typing.Tuple[bytes, str]] = {}
+        self._file_ids: typing.Dict[str, str] = {}
+        self._locks: typing.Dict[str, asyncio.Lock] = {}
+        self._loaded = asyncio.Event()
+
+    async def has(self, name: str) -> bool:
+        await self._loaded.wait()
+        return name in self._files
+
+    async def preload(self):
+        try:
+            self._files = await asyncio.get_running_loop().run_in_executor(
+                None, self._read_static_files
+            )
+            stored = await self._storage.get_all()
+            for name, (content, sha256) in self._files.items():
+                stored_sha256, file_id = stored.get(name, (None, None))
+                if stored_sha256 == sha256:
+                    self._file_ids[name] = file_id
+        finally:
+            self._loaded.set()
+        logger.info(
+            "Loaded %s static files, %s already uploaded",
+            len(self._files),
+            len(self._file_ids),
+        )
+
+    async def answer_photo(
+        self, message: aiogram.types.Message, name: str, *args, **kwargs
+    ) -> aiogram.types.Message:
+        await self._loaded.wait()
+        file_id = self._file_ids.get(name)
+        if file_id is not None:
+            try:
+                return await message.answer_photo(file_id, *args, **kwargs)
+            except (
+                WrongFileIdentifier,
+                WrongRemoteFileIdSpecified,
+                TypeOfFileMismatch,
+            ) as e:
+                logger.warning(
+                    "Stored file_id of %s was rejected (%s), uploading again", name, e
+                )
+                if self._file_ids.get(name) == file_id:
+                    del self._file_ids[name]
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            file_id = self._file_ids.get(name)
+            if file_id is not None:
+                return await message.answer_photo(file_id, *args, **kwargs)
+            content, sha256 = self._files[name]
+            sent_message = await message.answer_photo(
+                aiogram.types.InputFile(io.BytesIO(content), filename=name),
+                *args,
+                **kwargs,
+            )
+            file_id = sent_message.photo[-1].file_id
+            self._file_ids[name] = file_id
+            await self._storage.save(name, sha256, file_id)
+            return sent_message
+
+    def _read_static_files(self) -> typing.Dict[str, typing.Tuple[bytes, str]]:
+        files = {}
+        if not os.path.isdir(self._static_dir):
+            logger.warning("Static directory %s not found", self._static_dir)
+            return files
+        for name in sorted(os.listdir(self._static_dir)):
+            path = os.path.join(self._static_dir, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as file:
+                content = file.read()
+            files[name] = (content, hashlib.sha256(content).hexdigest())
+        return files
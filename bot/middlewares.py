@@ -0,0 +1,98 @@
+import typing
+
+import aiogram
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from db.storage import FSMStorage
+from utils.cache import LRUCache
+from utils.rate_limit import TokenBucket
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    def __init__(self, storage: FSMStorage):
+        super().__init__()
+        self._storage = storage
+
+    async def on_post_process_message(
+        self, message: aiogram.types.Message, results: list, data: dict
+    ):
+        await self._storage.flush(chat=message.chat.id, user=message.from_user.id)
+
+    async def on_post_process_callback_query(
+        self, call: aiogram.types.CallbackQuery, results: list, data: dict
+    ):
+        await self._storage.flush(
+            chat=call.message.chat.id if call.message else None,
+            user=call.from_user.id,
+        )
+
+
+class ReadinessMiddleware(BaseMiddleware):
+    def __init__(self, wait_ready: typing.Callable[[], typing.Awaitable]):
+        super().__init__()
+        self._wait_ready = wait_ready
+
+    async def on_pre_process_update(self, update: aiogram.types.Update, data: dict):
+        await self._wait_ready()
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        rate: float = 2,
+        burst: float = 10,
+        is_blocked: typing.Callable[[int], bool] | None = None,
+    ):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._is_blocked = is_blocked
+        self._buckets = LRUCache(max_size=100000, ttl=600)
+        self._warned = LRUCache(max_size=100000, ttl=60)
+        self.throttled = 0
+        self.blocked = 0
+
+    async def on_pre_process_message(self, message: aiogram.types.Message, data: dict):
+        if self._is_banned(message.from_user.id) or not self._consume(
+            message.from_user.id
+        ):
+            raise CancelHandler()
+
+    async def on_pre_process_callback_query(
+        self, call: aiogram.types.CallbackQuery, data: dict
+    ):
+        if self._is_banned(call.from_user.id):
+            raise CancelHandler()
+        if self._consume(call.from_user.id):
+            return
+        if call.from_user.id not in self._warned:
+            self._warned.set(call.from_user.id, True)
+            await call.answer("Слишком много запросов, подождите немного")
+        raise CancelHandler()
+
+    def render_metrics(self) -> typing.List[str]:
+        return [
+            f"antiflood_throttled_total {self.throttled}",
+            f"antiflood_blocked_total {self.blocked}",
+        ]
+
+    def report(self) -> str:
+        return f"Anti-flood: throttled {self.throttled}, blocked {self.blocked}"
+
+    def _is_banned(self, user_id: int) -> bool:
+        if self._is_blocked is not None and self._is_blocked(user_id):
+            self.blocked += 1
+            return True
+        return False
+
+    def _consume(self, user_id: int) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self._rate, capacity=self._burst)
+            self._buckets.set(user_id, bucket)
+        if bucket.consume():
+            self._warned.pop(user_id)
+            return True
+        self.throttled += 1
+        return False
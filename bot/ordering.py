@@ -0,0 +1,51 @@
+import typing
+import asyncio
+
+
+def update_chat_id(update: dict) -> int | None:
+    for key in (
+        "message",
+        "edited_message",
+        "callback_query",
+        "channel_post",
+        "edited_channel_post",
+    ):
+        event = update.get(key)
+        if not event:
+            continue
+        if key == "callback_query":
+            if event.get("message"):
+                return event["message"]["chat"]["id"]
+            return event["from"]["id"]
+        return event["chat"]["id"]
+    for event in update.values():
+        if isinstance(event, dict) and isinstance(event.get("from"), dict):
+            return event["from"]["id"]
+    return None
+
+
+class ChatSerializer:
+    def __init__(self):
+        self._locks: typing.Dict[typing.Hashable, asyncio.Lock] = {}
+        self._waiters: typing.Dict[typing.Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def run(
+        self, key: typing.Hashable, factory: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        if key is None:
+            return await factory()
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                return await factory()
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
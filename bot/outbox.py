@@ -0,0 +1,262 @@
+import time
+import typing
+import asyncio
+import logging
+
+import aiogram
+from aiogram.utils.exceptions import ChatNotFound, Unauthorized
+from aiogram.utils.markdown import quote_html
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from db.storage import (
+    Bonus,
+    BonusStorage,
+    Order,
+    OutboxEvent,
+    OutboxStorage,
+    User,
+    UserStorage,
+    shorten,
+)
+from utils.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+MAX_SUMMARY_BUTTONS = 50
+MAX_NAME_LENGTH = 100
+MAX_PHONE_LENGTH = 50
+MAX_ADDRESS_LENGTH = 400
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        bot: aiogram.Bot,
+        storage: OutboxStorage,
+        user_storage: UserStorage,
+        bonus_storage: BonusStorage,
+        admin_ids: typing.Iterable[int] = (),
+        batch_size: int = 20,
+        poll_interval: float = 1,
+        lease: float = 60,
+        max_backoff: float = 300,
+    ):
+        self._bot = bot
+        self._storage = storage
+        self._user_storage = user_storage
+        self._bonus_storage = bonus_storage
+        self._admin_ids = list(admin_ids)
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._lease = lease
+        self._max_backoff = max_backoff
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._held: typing.Set[int] = set()
+        self._lease_lock = asyncio.Lock()
+        self.delivered = 0
+        self.retries = 0
+        self.backlog = 0
+        self.lag = 0.0
+        self.delivery_lag = LatencyHistogram()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    def render_metrics(self) -> typing.List[str]:
+        lines = [
+            f"outbox_backlog {self.backlog}",
+            f"outbox_lag_seconds {self.lag:.3f}",
+            f"outbox_delivered_total {self.delivered}",
+            f"outbox_retries_total {self.retries}",
+        ]
+        lines.extend(self.delivery_lag.render("outbox_delivery_lag_seconds"))
+        return lines
+
+    def report(self) -> str:
+        delivery_lag = self.delivery_lag.summary()
+        return (
+            f"Outbox: backlog {self.backlog}, oldest {self.lag:.0f}s, "
+            f"delivered {self.delivered}, retries {self.retries}, "
+            f"delivery lag p95 {delivery_lag['p95']:.1f}s"
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                events = await self._storage.claim(self._batch_size, self._lease)
+                if events:
+                    await self._process_batch(events)
+                self.backlog, self.lag = await self._storage.get_backlog()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox poll failed")
+                events = []
+            if len(events) < self._batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _process_batch(self, events: typing.List[OutboxEvent]):
+        self._held = {event.id for event in events}
+        heartbeat = asyncio.create_task(self._keep_leases())
+        try:
+            for event in events:
+                await self._process(event)
+        finally:
+            self._held = set()
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _process(self, event: OutboxEvent):
+        try:
+            await self._deliver(event)
+        except Exception as e:
+            self.retries += 1
+            delay = min(2**event.attempts, self._max_backoff)
+            logger.warning(
+                "Outbox event %s failed (attempt %s), retrying in %ss: %s",
+                event.id,
+                event.attempts,
+                delay,
+                e,
+            )
+            async with self._lease_lock:
+                self._held.discard(event.id)
+                await self._storage.retry(event.id, delay, str(e))
+            return
+        async with self._lease_lock:
+            self._held.discard(event.id)
+            await self._storage.complete(event.id)
+        self.delivered += 1
+        self.delivery_lag.observe(
+            time.time() - event.created_at.timestamp() if event.created_at else 0
+        )
+
+    async def _deliver(self, event: OutboxEvent):
+        if event.kind == OutboxEvent.ORDER_PLACED:
+            await self._deliver_order(event)
+        else:
+            logger.warning("Unknown outbox event kind %s", event.kind)
+
+    async def _keep_leases(self):
+        while True:
+            await asyncio.sleep(self._lease / 3)
+            async with self._lease_lock:
+                if not self._held:
+                    continue
+                try:
+                    await self._storage.extend_lease(list(self._held), self._lease)
+                except Exception:
+                    logger.exception("Failed to extend outbox leases")
+
+    async def _deliver_order(self, event: OutboxEvent):
+        user = event.payload["user"]
+        orders = event.payload["orders"]
+        if user["inviter_id"]:
+            await self._bonus_storage.add_pending(
+                [
+                    Bonus(order["id"], user["inviter_id"], user["id"], order["bonus"])
+                    for order in orders
+                ]
+            )
+        admin_ids = list(self._admin_ids)
+        for admin_id in await self._user_storage.get_role_list(User.ADMIN):
+            if admin_id not in admin_ids:
+                admin_ids.append(admin_id)
+        if not admin_ids:
+            raise RuntimeError("no admins to notify")
+        chunks = self._build_summary(event.payload)
+        for admin_id in admin_ids:
+            if admin_id in event.delivered_to:
+                continue
+            try:
+                for index, (text, buttons) in enumerate(chunks):
+                    part = f"{admin_id}:{index}"
+                    if part in event.delivered_parts:
+                        continue
+                    keyboard = None
+                    if buttons:
+                        keyboard = InlineKeyboardMarkup()
+                        for button in buttons:
+                            keyboard.row(button)
+                    await self._bot.send_message(
+                        admin_id,
+                        text,
+                        parse_mode="HTML",
+                        reply_markup=keyboard,
+                        disable_web_page_preview=True,
+                    )
+                    await self._storage.mark_part_delivered(event.id, part)
+                    event.delivered_parts.append(part)
+            except (Unauthorized, ChatNotFound) as e:
+                logger.warning("Admin %s is unreachable: %s", admin_id, e)
+            await self._storage.mark_delivered_to(event.id, admin_id)
+            event.delivered_to.append(admin_id)
+
+    @classmethod
+    def _build_summary(
+        cls, payload: dict
+    ) -> typing.List[typing.Tuple[str, typing.List[InlineKeyboardButton]]]:
+        user = payload["user"]
+        orders = payload["orders"]
+        order_lines = []
+        bonus_buttons = []
+        for number, order in enumerate(orders, start=1):
+            order_text = Order(
+                buyer_id=user["id"],
+                link=order["link"],
+                price=order["price"],
+                size=order["size"],
+            ).custom_str(order["rub"])
+            order_lines.append(f"{number}. {quote_html(order_text)}")
+            if user["inviter_id"]:
+                bonus_buttons.append(
+                    InlineKeyboardButton(
+                        f"Выдать бонусы за №{number} ({order['bonus']} ₽)",
+                        callback_data=f"give_bonus {order['id']}",
+                    )
+                )
+        header = f"""❗️Новая заявка❗️\n\nПользователь <a href="tg://user?id={user['id']}">{quote_html(shorten(user['full_name'], MAX_NAME_LENGTH))}</a>\nC id: {user['id']}\n\nНомер телефона: {quote_html(shorten(user['phone'], MAX_PHONE_LENGTH))}\n\nАдрес доставки: {quote_html(shorten(user['address'], MAX_ADDRESS_LENGTH))}\n\nТоваров: {len(orders)}"""
+        footer = f"Приблизительная цена заказа в рублях: {payload['rub']} ₽\nПриблизительная прибыль заказа в рублях: {payload['profit']} ₽"
+        return cls._split_summary(header, order_lines, footer, bonus_buttons)
+
+    @staticmethod
+    def _split_summary(
+        header: str,
+        order_lines: typing.List[str],
+        footer: str,
+        bonus_buttons: typing.List[InlineKeyboardButton],
+    ) -> typing.List[typing.Tuple[str, typing.List[InlineKeyboardButton]]]:
+        chunks = []
+        lines = [header]
+        buttons = []
+        length = len(header)
+        for index, line in enumerate(order_lines):
+            if (
+                length + len(line) + 2 > MAX_MESSAGE_LENGTH - len(footer) - 2
+                or len(buttons) >= MAX_SUMMARY_BUTTONS
+            ):
+                chunks.append(("\n\n".join(lines), buttons))
+                lines, buttons, length = [], [], 0
+            lines.append(line)
+            length += len(line) + 2
+            if bonus_buttons:
+                buttons.append(bonus_buttons[index])
+        lines.append(footer)
+        chunks.append(("\n\n".join(lines), buttons))
+        return chunks
@@ -0,0 +1,252 @@
+import io
+import time
+import typing
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+import aiogram
+import aiohttp
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+from utils.cache import LRUCache
+from utils.metrics import LatencyHistogram, track_time
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "sendMediaGroup",
+    "sendAnimation",
+    "sendVideo",
+    "forwardMessage",
+    "copyMessage",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageMedia",
+    "editMessageReplyMarkup",
+}
+
+
+@dataclass
+class _Job:
+    chat_id: int
+    factory: typing.Callable[[], typing.Awaitable]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class OutboundDispatcher:
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        group_rate: float = 20 / 60,
+        concurrency: int = 8,
+        max_retries: int = 5,
+    ):
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._chat_buckets = LRUCache(max_size=50000, ttl=600)
+        self._concurrency = concurrency
+        self._max_retries = max_retries
+        self._chats: typing.Dict[int, deque] = {}
+        self._ready: asyncio.Queue | None = None
+        self._workers: typing.List[asyncio.Task] = []
+        self._background: typing.Set[asyncio.Task] = set()
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.send_latency = LatencyHistogram()
+        self.api_latency = LatencyHistogram()
+
+    async def start(self):
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self._concurrency)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for chat_queue in self._chats.values():
+            for job in chat_queue:
+                job.future.cancel()
+        self._chats.clear()
+        self.queue_depth = 0
+
+    async def submit(
+        self, chat_id: int, factory: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        if not self._workers:
+            return await factory()
+        job = _Job(chat_id, factory, asyncio.get_running_loop().create_future())
+        self.queue_depth += 1
+        chat_queue = self._chats.get(chat_id)
+        if chat_queue is None:
+            self._chats[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            chat_queue.append(job)
+        return await job.future
+
+    def fire(self, coro: typing.Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def render_metrics(self) -> typing.List[str]:
+        lines = [
+            f"tg_send_queue_depth {self.queue_depth}",
+            f"tg_send_in_flight {self.in_flight}",
+            f"tg_send_active_chats {len(self._chats)}",
+            f"tg_send_sent_total {self.sent}",
+            f"tg_send_failed_total {self.failed}",
+            f"tg_send_retries_total {self.retries}",
+            f"tg_send_flood_waits_total {self.flood_waits}",
+        ]
+        lines.extend(self.send_latency.render("tg_send_latency_seconds"))
+        lines.extend(self.api_latency.render("tg_api_latency_seconds"))
+        return lines
+
+    def report(self) -> str:
+        send_latency = self.send_latency.summary()
+        return (
+            f"Telegram: queue {self.queue_depth}, in flight {self.in_flight}, "
+            f"sent {self.sent}, failed {self.failed}, retries {self.retries}, "
+            f"flood waits {self.flood_waits}\n"
+            f"send latency p50/p95/p99 ms: {send_latency['p50'] * 1000:.0f} / "
+            f"{send_latency['p95'] * 1000:.0f} / {send_latency['p99'] * 1000:.0f}"
+        )
+
+    def _on_background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background send failed", exc_info=task.exception())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, capacity=self._chat_burst)
+            else:
+                bucket = TokenBucket(self._chat_rate, capacity=self._chat_burst)
+            self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _schedule(self, chat_id: int, delay: float):
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            chat_bucket = self._chat_bucket(chat_id)
+            delay = chat_bucket.delay()
+            if delay > 0:
+                self._schedule(chat_id, delay)
+                continue
+            await self._global_bucket.acquire()
+            chat_bucket.consume()
+            chat_queue = self._chats[chat_id]
+            job = chat_queue[0]
+            retry_in = await self._send(job, chat_bucket)
+            if retry_in is not None:
+                self._schedule(chat_id, retry_in)
+                continue
+            chat_queue.popleft()
+            self.queue_depth -= 1
+            if chat_queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._chats[chat_id]
+
+    async def _send(self, job: _Job, chat_bucket: TokenBucket) -> float | None:
+        job.attempts += 1
+        self.in_flight += 1
+        started_at = time.monotonic()
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            self.flood_waits += 1
+            chat_bucket.block(e.timeout)
+            if job.attempts <= self._max_retries:
+                self.retries += 1
+                logger.warning(
+                    "Flood control for chat %s, retrying in %ss", job.chat_id, e.timeout
+                )
+                return e.timeout
+            self._finish(job, exception=e)
+        except (NetworkError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if job.attempts <= self._max_retries:
+                self.retries += 1
+                return min(2 ** (job.attempts - 1), 30)
+            self._finish(job, exception=e)
+        except Exception as e:
+            self._finish(job, exception=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self.in_flight -= 1
+            self.api_latency.observe(time.monotonic() - started_at)
+        return None
+
+    def _finish(self, job: _Job, result: typing.Any = None, exception=None):
+        self.send_latency.observe(time.monotonic() - job.enqueued_at)
+        if exception is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(exception)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+class ThrottledBot(aiogram.Bot):
+    def __init__(self, *args, outbound: OutboundDispatcher | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = outbound
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await self._request(method, data, files, **kwargs)
+        finally:
+            track_time("telegram", time.perf_counter() - started_at)
+
+    async def _request(self, method, data=None, files=None, **kwargs):
+        chat_id = data.get("chat_id") if data else None
+        if (
+            self.outbound is None
+            or method not in THROTTLED_METHODS
+            or chat_id is None
+            or not str(chat_id).lstrip("-").isdigit()
+        ):
+            return await super().request(method, data, files, **kwargs)
+
+        async def send():
+            for value in (files or {}).values():
+                file = getattr(value, "file", None)
+                if isinstance(file, io.IOBase) and file.seekable():
+                    file.seek(0)
+            return await super(ThrottledBot, self).request(
+                method, data, files, **kwargs
+            )
+
+        return await self.outbound.submit(int(chat_id), send)
@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import typing
+import asyncio
+import logging
+
+import aiogram
+
+from bot.ordering import ChatSerializer, update_chat_id
+from utils.metrics import format_labels
+
+logger = logging.getLogger(__name__)
+
+STREAM_LIMIT = 16 * 1024 * 1024
+MAX_ATTEMPTS = 2
+
+
+def shard_for(update: dict, shards: int) -> int:
+    chat_id = update_chat_id(update)
+    return chat_id % shards if chat_id is not None else 0
+
+
+class ShardProcess:
+    STARTING = "starting"
+    READY = "ready"
+
+    def __init__(
+        self, index: int, command: typing.List[str], health_timeout: float = 30
+    ):
+        self.index = index
+        self._command = command
+        self._health_timeout = health_timeout
+        self._process: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._pending: typing.Dict[int, typing.Tuple[dict, int]] = {}
+        self.last_pong = 0.0
+        self.state = self.STARTING
+        self.restarts = 0
+        self.forwarded = 0
+        self.dropped = 0
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        async with self._lock:
+            await self._spawn()
+
+    async def stop(self):
+        async with self._lock:
+            if self.alive:
+                self._process.stdin.close()
+                try:
+                    await asyncio.wait_for(self._process.wait(), self._health_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("Shard %s did not exit in time", self.index)
+            await self._kill()
+
+    async def send(self, update: dict):
+        async with self._lock:
+            self._pending[update["update_id"]] = (update, 1)
+            self.forwarded += 1
+            if not await self._write({"update": update}):
+                await self._restart("stdin is closed or not being read")
+
+    async def check(self):
+        async with self._lock:
+            if not self.alive:
+                await self._restart(f"exited with code {self._process.returncode}")
+            elif time.monotonic() - self.last_pong > self._health_timeout:
+                await self._restart(
+                    f"no health check reply for {self._health_timeout}s"
+                )
+            elif not await self._write({"ping": time.time()}):
+                await self._restart("stdin is closed or not being read")
+
+    async def _restart(self, reason: str):
+        logger.warning("Shard %s is unhealthy (%s), restarting", self.index, reason)
+        self.restarts += 1
+        await self._kill()
+        await self._spawn()
+        replayed = 0
+        for update_id in sorted(self._pending):
+            update, attempts = self._pending[update_id]
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(
+                    "Dropping update %s after %s attempts", update_id, attempts
+                )
+                del self._pending[update_id]
+                self.dropped += 1
+                continue
+            self._pending[update_id] = (update, attempts + 1)
+            await self._write({"update": update})
+            replayed += 1
+        if replayed:
+            logger.info("Replayed %s updates to shard %s", replayed, self.index)
+
+    async def _spawn(self):
+        self._process = await asyncio.create_subprocess_exec(
+            *self._command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        self.last_pong = time.monotonic()
+        self.state = self.STARTING
+        self._reader = asyncio.create_task(self._read(self._process))
+        logger.info("Started shard %s (pid %s)", self.index, self._process.pid)
+
+    async def _kill(self):
+        if self._process is None:
+            return
+        if self._process.returncode is None:
+            self._process.kill()
+        await self._process.wait()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def _write(self, message: dict) -> bool:
+        try:
+            self._process.stdin.write(json.dumps(message).encode() + b"\n")
+            await asyncio.wait_for(self._process.stdin.drain(), self._health_timeout)
+        except (BrokenPipeError, ConnectionResetError, asyncio.TimeoutError):
+            return False
+        return True
+
+    async def _read(self, process: asyncio.subprocess.Process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if "done" in message:
+                self._pending.pop(message["done"], None)
+            elif "pong" in message:
+                self.last_pong = time.monotonic()
+                self.state = message.get("state", self.READY)
+
+
+class ShardFront:
+    def __init__(
+        self,
+        bot: aiogram.Bot,
+        command: typing.Callable[[int, int], typing.List[str]],
+        shards: int,
+        health_interval: float = 5,
+        health_timeout: float = 30,
+    ):
+        self._bot = bot
+        self._shards = [
+            ShardProcess(index, command(index, shards), health_timeout)
+            for index in range(shards)
+        ]
+        self._health_interval = health_interval
+
+    async def run(self):
+        await asyncio.gather(*(shard.start() for shard in self._shards))
+        supervisor = asyncio.create_task(self._supervise())
+        try:
+            await self._bot.delete_webhook()
+            offset = None
+            while True:
+                try:
+                    updates = await self._bot.get_updates(offset=offset, timeout=20)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Failed to get updates")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    data = update.to_python()
+                    await self._shards[shard_for(data, len(self._shards))].send(data)
+                    offset = update.update_id + 1
+        finally:
+            supervisor.cancel()
+            await asyncio.gather(supervisor, return_exceptions=True)
+            await asyncio.gather(*(shard.stop() for shard in self._shards))
+
+    def render_metrics(self) -> typing.List[str]:
+        lines = []
+        for shard in self._shards:
+            labels = format_labels({"shard": str(shard.index)})
+            lines.extend(
+                [
+                    f"shard_up{labels} {int(shard.alive)}",
+                    f"shard_ready{labels} {int(shard.state == ShardProcess.READY)}",
+                    f"shard_pending_updates{labels} {shard.pending}",
+                    f"shard_forwarded_total{labels} {shard.forwarded}",
+                    f"shard_restarts_total{labels} {shard.restarts}",
+                    f"shard_dropped_total{labels} {shard.dropped}",
+                ]
+            )
+        return lines
+
+    def report(self) -> str:
+        return "Shards: " + ", ".join(
+            f"#{shard.index} {shard.state if shard.alive else 'down'} "
+            f"(pending {shard.pending}, restarts {shard.restarts})"
+            for shard in self._shards
+        )
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self._health_interval)
+            for shard in self._shards:
+                try:
+                    await shard.check()
+                except Exception:
+                    logger.exception("Health check of shard %s failed", shard.index)
+
+
+class ShardWorker:
+    def __init__(self):
+        self._dispatcher: aiogram.Dispatcher | None = None
+        self._ready = asyncio.Event()
+        self._serializer = ChatSerializer()
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._reader: asyncio.Task | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self.failed = 0
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        protocol_output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, protocol_output
+        )
+        self._writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        self._reader = asyncio.create_task(self._read(reader))
+
+    async def serve(self, dispatcher: aiogram.Dispatcher):
+        self._dispatcher = dispatcher
+        self._ready.set()
+        await self._reader
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=10)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if "ping" in message:
+                self._send(
+                    {
+                        "pong": message["ping"],
+                        "state": (
+                            ShardProcess.READY
+                            if self._ready.is_set()
+                            else ShardProcess.STARTING
+                        ),
+                        "pending": len(self._tasks),
+                    }
+                )
+            elif "update" in message:
+                data = message["update"]
+                task = asyncio.create_task(
+                    self._serializer.run(
+                        update_chat_id(data), lambda data=data: self._process(data)
+                    )
+                )
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, data: dict):
+        await self._ready.wait()
+        aiogram.Bot.set_current(self._dispatcher.bot)
+        aiogram.Dispatcher.set_current(self._dispatcher)
+        try:
+            await self._dispatcher.process_update(aiogram.types.Update(**data))
+        except Exception:
+            self.failed += 1
+            logger.exception("Failed to process update %s", data.get("update_id"))
+        self._send({"done": data["update_id"]})
+
+    def _send(self, message: dict):
+        self._writer.write(json.dumps(message).encode() + b"\n")
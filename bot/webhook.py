@@ -0,0 +1,98 @@
+import json
+import typing
+import asyncio
+import logging
+
+import aiogram
+from aiohttp import web
+
+from bot.ordering import ChatSerializer, update_chat_id
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dispatcher: aiogram.Dispatcher,
+        path: str = "/webhook",
+        secret: str | None = None,
+        max_concurrency: int = 256,
+    ):
+        self._dispatcher = dispatcher
+        self._path = path
+        self._secret = secret
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._serializer = ChatSerializer()
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._runner: web.AppRunner | None = None
+        self.received = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self._path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        app.router.add_get("/metrics", METRICS.handle)
+        return app
+
+    async def start(
+        self,
+        host: str,
+        port: int,
+        url: str | None = None,
+        app: web.Application | None = None,
+    ):
+        self._runner = web.AppRunner(app or self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if url:
+            await self._dispatcher.bot.set_webhook(
+                url.rstrip("/") + self._path,
+                secret_token=self._secret,
+                max_connections=100,
+            )
+        logger.info("Webhook server listening on %s:%s%s", host, port, self._path)
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=10)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "pending": self.pending})
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if (
+            self._secret
+            and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self._secret
+        ):
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+        self.received += 1
+        aiogram.Bot.set_current(self._dispatcher.bot)
+        aiogram.Dispatcher.set_current(self._dispatcher)
+        task = asyncio.create_task(
+            self._serializer.run(update_chat_id(data), lambda: self._process(data))
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, data: dict):
+        async with self._semaphore:
+            try:
+                await self._dispatcher.process_update(aiogram.types.Update(**data))
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to process update %s", data.get("update_id"))
@@ -1,34 +1,217 @@
+import re
+import hashlib
+import sys
+import time
+import asyncio
+import logging
 import asyncpg
-from typing import List, Any
+from contextlib import asynccontextmanager
+from typing import List, Any, AsyncIterator, Dict, Tuple
+
+from utils.metrics import LatencyHistogram, format_labels, track_time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryStats():
+    def __init__(self, name:str, query:str):
+        self.name = name
+        self.query = query
+        self.digest = hashlib.sha1(query.encode()).hexdigest()[:8]
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = LatencyHistogram()
+        self.pool_wait = LatencyHistogram()
+
+    def summary(self) -> Dict[str, Any]:
+        latency = self.latency.summary()
+        return {
+            "name": self.name,
+            "query": self.query,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total": self.latency.sum,
+            "p50": latency["p50"],
+            "p95": latency["p95"],
+            "p99": latency["p99"],
+            "pool_wait_p95": self.pool_wait.quantile(0.95),
+        }
+
 
 class DB():
-    def __init__(self, host:str, port:str, login:str, password:str, database:str, pool_size:int=10):
+    def __init__(self, host:str, port:str, login:str, password:str, database:str, pool_size:int=10,
+                 min_pool_size:int=1, statement_cache_size:int=1024, command_timeout:float|None=None,
+                 max_inactive_connection_lifetime:float=300.0, max_queries:int=50000,
+                 slow_query_threshold:float|None=0.5):
         self._host = host
         self._port = port
         self._login = login
         self._password = password
         self._database = database
         self._pool_size = pool_size
+        self._min_pool_size = min(min_pool_size, pool_size)
+        self._statement_cache_size = statement_cache_size
+        self._command_timeout = command_timeout
+        self._max_inactive_connection_lifetime = max_inactive_connection_lifetime
+        self._max_queries = max_queries
+        self._slow_query_threshold = slow_query_threshold
+        self._stats: Dict[Tuple[str, str], QueryStats] = {}
 
     async def init(self):
-        self._pool = await asyncpg.create_pool(f"postgres://{self._login}:{self._password}@{self._host}:{self._port}/{self._database}")
-    
-    async def execute(self, query, *params):
+        self._pool = await asyncpg.create_pool(
+            f"postgres://{self._login}:{self._password}@{self._host}:{self._port}/{self._database}",
+            min_size=self._min_pool_size,
+            max_size=self._pool_size,
+            statement_cache_size=self._statement_cache_size,
+            command_timeout=self._command_timeout,
+            max_inactive_connection_lifetime=self._max_inactive_connection_lifetime,
+            max_queries=self._max_queries,
+        )
+
+    async def warm_up(self, connections:int):
+        connections = min(connections, self._pool_size)
+
+        async def ping():
+            async with self._pool.acquire() as conn:
+                await conn.fetchval("SELECT 1")
+
+        await asyncio.gather(*(ping() for _ in range(connections)))
+
+    async def close(self):
+        await self._pool.close()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[asyncpg.Connection]:
+        stats = self._get_stats(sys._getframe(2).f_code.co_qualname, "<transaction>")
+        started_at = time.perf_counter()
         async with self._pool.acquire() as conn:
-            async with conn.transaction():
-                return await conn.execute(query, *params)
-    
+            acquired_at = time.perf_counter()
+            try:
+                async with conn.transaction():
+                    yield conn
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                self._observe(stats, started_at, acquired_at, 0)
+
+    async def execute(self, query, *params):
+        return await self._run("execute", sys._getframe(1).f_code.co_qualname, query, params)
+
     async def fetchrow(self, query, *params) -> List:
-        async with self._pool.acquire() as conn:
-            async with conn.transaction():
-                return await conn.fetchrow(query, *params)
-    
+        return await self._run("fetchrow", sys._getframe(1).f_code.co_qualname, query, params)
+
     async def fetch(self, query, *params) -> List[List]:
-        async with self._pool.acquire() as conn:
-            async with conn.transaction():
-                return await conn.fetch(query, *params)
-    
+        return await self._run("fetch", sys._getframe(1).f_code.co_qualname, query, params)
+
     async def fetchval(self, query, *params) -> Any:
+        return await self._run("fetchval", sys._getframe(1).f_code.co_qualname, query, params)
+
+    async def iterate(self, query, *params, batch_size:int=1000) -> AsyncIterator[asyncpg.Record]:
+        stats = self._get_stats(sys._getframe(1).f_code.co_qualname, query)
+        started_at = time.perf_counter()
+        rows = 0
+        async with self._pool.acquire() as conn:
+            acquired_at = time.perf_counter()
+            try:
+                async with conn.transaction():
+                    async for record in conn.cursor(query, *params, prefetch=batch_size):
+                        rows += 1
+                        yield record
+            except GeneratorExit:
+                raise
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                self._observe(stats, started_at, acquired_at, rows)
+
+    async def copy_from_query(self, query, *params, output, format:str="csv", header:bool=True) -> str:
+        return await self._run(
+            "copy_from_query", sys._getframe(1).f_code.co_qualname, query, params,
+            output=output, format=format, header=header,
+        )
+
+    def query_stats(self) -> List[Dict[str, Any]]:
+        return sorted((stats.summary() for stats in self._stats.values()), key=lambda stats: stats["total"], reverse=True)
+
+    def render_metrics(self) -> List[str]:
+        lines = []
+        for stats in self._stats.values():
+            labels = {"query": stats.name, "statement": stats.digest}
+            lines.extend(stats.latency.render("db_query_duration_seconds", labels))
+            lines.extend(stats.pool_wait.render("db_pool_wait_seconds", labels))
+            lines.append(f"db_query_errors_total{format_labels(labels)} {stats.errors}")
+            lines.append(f"db_query_rows_total{format_labels(labels)} {stats.rows}")
+        if getattr(self, "_pool", None) is not None:
+            lines.append(f"db_pool_size {self._pool.get_size()}")
+            lines.append(f"db_pool_idle {self._pool.get_idle_size()}")
+        return lines
+
+    def report(self, limit:int=15) -> str:
+        lines = ["DB: calls / p50 / p95 / p99 ms / pool wait p95 ms / rows"]
+        for stats in self.query_stats()[:limit]:
+            lines.append(
+                f"{stats['name']}: {stats['calls']} / {stats['p50'] * 1000:.1f} / {stats['p95'] * 1000:.1f} / "
+                f"{stats['p99'] * 1000:.1f} / {stats['pool_wait_p95'] * 1000:.1f} / {stats['rows']}"
+                + (f" ({stats['errors']} errors)" if stats["errors"] else "")
+            )
+        return "\n".join(lines)
+
+    async def _run(self, method:str, name:str, query:str, params:tuple, **kwargs) -> Any:
+        stats = self._get_stats(name, query)
+        started_at = time.perf_counter()
         async with self._pool.acquire() as conn:
-            async with conn.transaction():
-                return await conn.fetchval(query, *params)
\ No newline at end of file
+            acquired_at = time.perf_counter()
+            try:
+                result = await getattr(conn, method)(query, *params, **kwargs)
+            except BaseException:
+                stats.errors += 1
+                self._observe(stats, started_at, acquired_at, 0)
+                raise
+        self._observe(stats, started_at, acquired_at, _count_rows(method, result))
+        return result
+
+    def _get_stats(self, name:str, query:str) -> QueryStats:
+        stats = self._stats.get((name, query))
+        if stats is None:
+            stats = self._stats[(name, query)] = QueryStats(name, _WHITESPACE.sub(" ", query).strip())
+        return stats
+
+    def _observe(self, stats:QueryStats, started_at:float, acquired_at:float, rows:int):
+        finished_at = time.perf_counter()
+        stats.calls += 1
+        stats.rows += rows
+        stats.latency.observe(finished_at - started_at)
+        stats.pool_wait.observe(acquired_at - started_at)
+        track_time("db", finished_at - started_at)
+        if self._slow_query_threshold is not None and finished_at - started_at >= self._slow_query_threshold:
+            logger.warning(
+                "Slow query %s took %.1f ms (pool wait %.1f ms): %s",
+                stats.name, (finished_at - started_at) * 1000, (acquired_at - started_at) * 1000, stats.query[:200],
+            )
+
+
+def _count_rows(method:str, result:Any) -> int:
+    if method == "fetch":
+        return len(result)
+    if method in ("fetchrow", "fetchval"):
+        return int(result is not None)
+    status = result.rsplit(" ", 1)[-1] if isinstance(result, str) else ""
+    return int(status) if status.isdigit() else 0
+
+
+def make_db() -> DB:
+    return DB(host=Config.HOST, port=Config.PORT, login=Config.LOGIN, password=Config.PASSWORD,
+              database=Config.DATABASE, pool_size=getattr(Config, "DB_POOL_MAX_SIZE", 10),
+              min_pool_size=getattr(Config, "DB_POOL_MIN_SIZE", 1),
+              statement_cache_size=getattr(Config, "DB_STATEMENT_CACHE_SIZE", 1024),
+              command_timeout=getattr(Config, "DB_COMMAND_TIMEOUT", None),
+              max_inactive_connection_lifetime=getattr(Config, "DB_MAX_INACTIVE_CONNECTION_LIFETIME", 300.0),
+              max_queries=getattr(Config, "DB_MAX_QUERIES", 50000),
+              slow_query_threshold=getattr(Config, "DB_SLOW_QUERY_THRESHOLD", 0.5))
@@ -0,0 +1,373 @@
+import logging
+from typing import List
+from dataclasses import dataclass
+
+import asyncpg
+
+from db.db import DB
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK_ID = 7_246_311
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "create users",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            role TEXT,
+            full_name TEXT DEFAULT NULL,
+            phone TEXT DEFAULT NULL,
+            address TEXT DEFAULT NULL,
+            balance INT NOT NULL DEFAULT 0,
+            inviter_id BIGINT DEFAULT NULL
+        )
+        """,
+    ),
+    Migration(
+        2,
+        "create orders",
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id SERIAL PRIMARY KEY,
+            buyer_id BIGINT,
+            link TEXT,
+            size TEXT NOT NULL DEFAULT 'one size',
+            price INT,
+            FOREIGN KEY (buyer_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ),
+    Migration(
+        3,
+        "create fsm_states",
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            chat_id BIGINT,
+            user_id BIGINT,
+            state TEXT DEFAULT NULL,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (chat_id, user_id)
+        )
+        """,
+    ),
+    Migration(
+        4,
+        "create exchange_rates",
+        """
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            currency TEXT PRIMARY KEY,
+            rate DOUBLE PRECISION NOT NULL,
+            fetched_at TIMESTAMPTZ NOT NULL,
+            etag TEXT DEFAULT NULL,
+            last_modified TEXT DEFAULT NULL
+        )
+        """,
+    ),
+    Migration(
+        5,
+        "create media_files",
+        """
+        CREATE TABLE IF NOT EXISTS media_files (
+            name TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+    ),
+    Migration(
+        6,
+        "index orders by buyer",
+        "CREATE INDEX IF NOT EXISTS orders_buyer_id_idx ON orders (buyer_id, id)",
+    ),
+    Migration(
+        7,
+        "partial index on privileged and blocked users",
+        """
+        CREATE INDEX IF NOT EXISTS users_role_idx ON users (role)
+        WHERE role IN ('admin', 'blocked')
+        """,
+    ),
+    Migration(
+        8,
+        "track users who blocked the bot",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS unreachable BOOLEAN NOT NULL DEFAULT FALSE",
+    ),
+    Migration(
+        9,
+        "create broadcasts",
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            created_by BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ DEFAULT NULL
+        );
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INT REFERENCES broadcasts(id) ON DELETE CASCADE,
+            user_id BIGINT,
+            status TEXT NOT NULL,
+            error TEXT DEFAULT NULL,
+            sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (broadcast_id, user_id)
+        )
+        """,
+    ),
+    Migration(
+        10,
+        "create bonus_ledger",
+        """
+        CREATE TABLE IF NOT EXISTS bonus_ledger (
+            id SERIAL PRIMARY KEY,
+            order_id INT NOT NULL,
+            inviter_id BIGINT NOT NULL,
+            buyer_id BIGINT NOT NULL,
+            amount INT NOT NULL CHECK (amount >= 0),
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            paid_at TIMESTAMPTZ DEFAULT NULL,
+            UNIQUE (order_id, inviter_id)
+        );
+        CREATE INDEX IF NOT EXISTS bonus_ledger_approved_idx ON bonus_ledger (inviter_id)
+        WHERE status = 'approved'
+        """,
+    ),
+    Migration(
+        11,
+        "create trigger-maintained counters",
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+
+        CREATE OR REPLACE FUNCTION count_users() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            total BIGINT := 0;
+            registered BIGINT := 0;
+            blocked BIGINT := 0;
+            referrals BIGINT := 0;
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                SELECT
+                    total + COUNT(*),
+                    registered + COUNT(*) FILTER (WHERE full_name IS NOT NULL),
+                    blocked + COUNT(*) FILTER (WHERE role = 'blocked'),
+                    referrals + COUNT(*) FILTER (WHERE inviter_id IS NOT NULL)
+                INTO total, registered, blocked, referrals FROM new_rows;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT
+                    total - COUNT(*),
+                    registered - COUNT(*) FILTER (WHERE full_name IS NOT NULL),
+                    blocked - COUNT(*) FILTER (WHERE role = 'blocked'),
+                    referrals - COUNT(*) FILTER (WHERE inviter_id IS NOT NULL)
+                INTO total, registered, blocked, referrals FROM old_rows;
+            END IF;
+            IF total <> 0 OR registered <> 0 OR blocked <> 0 OR referrals <> 0 THEN
+                UPDATE counters SET value = value + CASE name
+                    WHEN 'users_total' THEN total
+                    WHEN 'users_registered' THEN registered
+                    WHEN 'users_blocked' THEN blocked
+                    WHEN 'referrals' THEN referrals
+                END
+                WHERE name IN ('users_total', 'users_registered', 'users_blocked', 'referrals');
+            END IF;
+            RETURN NULL;
+        END $$;
+
+        CREATE OR REPLACE FUNCTION count_orders() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            delta BIGINT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT COUNT(*) INTO delta FROM new_rows;
+            ELSE
+                SELECT -COUNT(*) INTO delta FROM old_rows;
+            END IF;
+            IF delta <> 0 THEN
+                UPDATE counters SET value = value + delta WHERE name = 'orders_open';
+            END IF;
+            RETURN NULL;
+        END $$;
+
+        CREATE TRIGGER users_count_insert AFTER INSERT ON users
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+        CREATE TRIGGER users_count_update AFTER UPDATE ON users
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+        CREATE TRIGGER users_count_delete AFTER DELETE ON users
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_users();
+        CREATE TRIGGER orders_count_insert AFTER INSERT ON orders
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_orders();
+        CREATE TRIGGER orders_count_delete AFTER DELETE ON orders
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_orders();
+
+        LOCK TABLE users, orders IN SHARE MODE;
+        INSERT INTO counters (name, value)
+        SELECT 'users_total', COUNT(*) FROM users
+        UNION ALL SELECT 'users_registered', COUNT(*) FROM users WHERE full_name IS NOT NULL
+        UNION ALL SELECT 'users_blocked', COUNT(*) FROM users WHERE role = 'blocked'
+        UNION ALL SELECT 'referrals', COUNT(*) FROM users WHERE inviter_id IS NOT NULL
+        UNION ALL SELECT 'orders_open', COUNT(*) FROM orders
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        """,
+    ),
+    Migration(
+        12,
+        "create outbox",
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            delivered_to BIGINT[] NOT NULL DEFAULT '{}',
+            attempts INT NOT NULL DEFAULT 0,
+            last_error TEXT DEFAULT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            delivered_at TIMESTAMPTZ DEFAULT NULL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (next_attempt_at)
+        WHERE delivered_at IS NULL
+        """,
+    ),
+    Migration(
+        13,
+        "create order_history",
+        """
+        CREATE TABLE IF NOT EXISTS order_history (
+            id INT NOT NULL,
+            buyer_id BIGINT NOT NULL,
+            link TEXT,
+            size TEXT NOT NULL,
+            price INT NOT NULL,
+            yuan_rate NUMERIC(12, 6) NOT NULL,
+            rub_price INT NOT NULL,
+            profit INT NOT NULL,
+            bonus INT NOT NULL DEFAULT 0,
+            placed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, placed_at)
+        ) PARTITION BY RANGE (placed_at);
+        CREATE TABLE IF NOT EXISTS order_history_default PARTITION OF order_history DEFAULT;
+        CREATE INDEX IF NOT EXISTS order_history_buyer_idx
+        ON order_history (buyer_id, placed_at DESC);
+        CREATE INDEX IF NOT EXISTS order_history_placed_at_brin
+        ON order_history USING BRIN (placed_at);
+        CREATE OR REPLACE FUNCTION create_order_history_partition(month TIMESTAMPTZ)
+        RETURNS TEXT AS $$
+        DECLARE
+            starts_at TIMESTAMPTZ := date_trunc('month', month);
+            partition TEXT := 'order_history_' || to_char(starts_at, 'YYYY_MM');
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF order_history '
+                'FOR VALUES FROM (%L) TO (%L)',
+                partition, starts_at, starts_at + INTERVAL '1 month'
+            );
+            RETURN partition;
+        END
+        $$ LANGUAGE plpgsql;
+        SELECT create_order_history_partition(now() + make_interval(months => months))
+        FROM generate_series(0, 2) AS months
+        """,
+    ),
+    Migration(
+        14,
+        "record legacy bonuses and opening balances in bonus_ledger",
+        """
+        ALTER TABLE bonus_ledger
+            ALTER COLUMN order_id DROP NOT NULL,
+            ALTER COLUMN buyer_id DROP NOT NULL,
+            ADD COLUMN IF NOT EXISTS legacy_key TEXT UNIQUE,
+            DROP CONSTRAINT IF EXISTS bonus_ledger_amount_check,
+            ADD CONSTRAINT bonus_ledger_amount_check CHECK (amount >= 0 OR order_id IS NULL);
+        INSERT INTO bonus_ledger (inviter_id, amount, status, paid_at, legacy_key)
+        SELECT users.id, users.balance - COALESCE(ledger.amount, 0), 'paid', now(), 'opening ' || users.id
+        FROM users LEFT JOIN (
+            SELECT inviter_id, SUM(amount) AS amount FROM bonus_ledger
+            WHERE status = 'paid' GROUP BY inviter_id
+        ) ledger ON ledger.inviter_id = users.id
+        WHERE users.balance <> COALESCE(ledger.amount, 0)
+        ON CONFLICT DO NOTHING
+        """,
+    ),
+    Migration(
+        15,
+        "track outbox delivery per message part",
+        """
+        ALTER TABLE outbox ADD COLUMN IF NOT EXISTS delivered_parts TEXT[] NOT NULL DEFAULT '{}'
+        """,
+    ),
+]
+
+
+class Migrator:
+    __table = "schema_version"
+
+    def __init__(self, db: DB, migrations: List[Migration] = MIGRATIONS):
+        self._db = db
+        self._migrations = sorted(migrations, key=lambda migration: migration.version)
+
+    async def get_applied_versions(self) -> set:
+        try:
+            data = await self._db.fetch(f"SELECT version FROM {self.__table}")
+        except asyncpg.UndefinedTableError:
+            async with self._db.transaction() as conn:
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock($1)", MIGRATIONS_LOCK_ID
+                )
+                await conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.__table} (
+                        version INT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """
+                )
+            return set()
+        return {version_data[0] for version_data in data}
+
+    async def run(self) -> List[int]:
+        applied_versions = await self.get_applied_versions()
+        applied_now = []
+        for migration in self._migrations:
+            if migration.version in applied_versions:
+                continue
+            async with self._db.transaction() as conn:
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock($1)", MIGRATIONS_LOCK_ID
+                )
+                if await conn.fetchval(
+                    f"SELECT 1 FROM {self.__table} WHERE version = $1",
+                    migration.version,
+                ):
+                    continue
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    f"INSERT INTO {self.__table} (version, name) VALUES ($1, $2)",
+                    migration.version,
+                    migration.name,
+                )
+            logger.info("Applied migration %s: %s", migration.version, migration.name)
+            applied_now.append(migration.version)
+        return applied_now
@@ -1,2 +1,10 @@
-from .users import User, UserStorage
-from .orders import Order, OrderStorage
+from .users import User, UserStorage, CachedUserStorage
+from .orders import Order, OrderStorage, shorten
+from .fsm import FSMStorage
+from .rates import Rate, RateStorage
+from .media import MediaStorage
+from .broadcasts import Broadcast, BroadcastStorage
+from .bonuses import Bonus, BonusStorage
+from .stats import StatsStorage
+from .outbox import OutboxEvent, OutboxStorage
+from .order_history import SoldOrder, OrderHistoryStorage
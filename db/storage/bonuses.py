@@ -0,0 +1,133 @@
+from db.db import DB
+from typing import Dict, List, Tuple
+from dataclasses import dataclass
+
+
+@dataclass
+class Bonus:
+    PENDING = "pending"
+    APPROVED = "approved"
+    PAID = "paid"
+
+    order_id: int
+    inviter_id: int
+    buyer_id: int
+    amount: int
+    status: str = PENDING
+
+
+class BonusStorage:
+    __table = "bonus_ledger"
+    __users_table = "users"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def add_pending(self, bonuses: List[Bonus]):
+        await self._db.execute(
+            f"""
+            INSERT INTO {self.__table} (order_id, inviter_id, buyer_id, amount)
+            SELECT * FROM unnest($1::int[], $2::bigint[], $3::bigint[], $4::int[])
+            ON CONFLICT (order_id, inviter_id) DO NOTHING
+        """,
+            [bonus.order_id for bonus in bonuses],
+            [bonus.inviter_id for bonus in bonuses],
+            [bonus.buyer_id for bonus in bonuses],
+            [bonus.amount for bonus in bonuses],
+        )
+
+    async def approve(self, order_id: int) -> Bonus | None:
+        data = await self._db.fetchrow(
+            f"""
+            UPDATE {self.__table} SET status = $1 WHERE order_id = $2 AND status = $3
+            RETURNING order_id, inviter_id, buyer_id, amount, status
+        """,
+            Bonus.APPROVED,
+            order_id,
+            Bonus.PENDING,
+        )
+        if data is None:
+            return None
+        return Bonus(data[0], data[1], data[2], data[3], data[4])
+
+    async def approve_legacy(
+        self, key: str, inviter_id: int, amount: int, order_id: int | None = None
+    ) -> Bonus | None:
+        data = await self._db.fetchrow(
+            f"""
+            INSERT INTO {self.__table} (order_id, inviter_id, amount, status, legacy_key)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT DO NOTHING
+            RETURNING order_id, inviter_id, buyer_id, amount, status
+        """,
+            order_id,
+            inviter_id,
+            amount,
+            Bonus.APPROVED,
+            key,
+        )
+        if data is None:
+            return None
+        return Bonus(data[0], data[1], data[2], data[3], data[4])
+
+    async def pay_out(self) -> List[Tuple[int, int, int]]:
+        data = await self._db.fetch(
+            f"""
+            WITH paid AS (
+                UPDATE {self.__table} SET status = $1, paid_at = now()
+                WHERE status = $2 AND EXISTS (
+                    SELECT 1 FROM {self.__users_table}
+                    WHERE {self.__users_table}.id = {self.__table}.inviter_id
+                )
+                RETURNING inviter_id, amount
+            ), totals AS (
+                SELECT inviter_id, SUM(amount) AS amount, COUNT(*) AS orders
+                FROM paid GROUP BY inviter_id
+            )
+            UPDATE {self.__users_table} SET balance = balance + totals.amount
+            FROM totals WHERE {self.__users_table}.id = totals.inviter_id
+            RETURNING {self.__users_table}.id, totals.amount, totals.orders
+        """,
+            Bonus.PAID,
+            Bonus.APPROVED,
+        )
+        return [
+            (payout_data[0], payout_data[1], payout_data[2]) for payout_data in data
+        ]
+
+    async def get_totals(self) -> Dict[str, Tuple[int, int]]:
+        data = await self._db.fetch(
+            f"SELECT status, COUNT(*), COALESCE(SUM(amount), 0) FROM {self.__table} GROUP BY status"
+        )
+        return {
+            totals_data[0]: (totals_data[1], totals_data[2]) for totals_data in data
+        }
+
+    async def get_drift_count(self) -> int:
+        return await self._db.fetchval(
+            f"""
+            SELECT COUNT(*)
+            FROM {self.__users_table} LEFT JOIN (
+                SELECT inviter_id, SUM(amount) AS amount FROM {self.__table}
+                WHERE status = $1 GROUP BY inviter_id
+            ) ledger ON ledger.inviter_id = {self.__users_table}.id
+            WHERE {self.__users_table}.balance <> COALESCE(ledger.amount, 0)
+        """,
+            Bonus.PAID,
+        )
+
+    async def get_drift(self, limit: int = 20) -> List[Tuple[int, int, int]]:
+        data = await self._db.fetch(
+            f"""
+            SELECT {self.__users_table}.id, {self.__users_table}.balance, COALESCE(ledger.amount, 0)
+            FROM {self.__users_table} LEFT JOIN (
+                SELECT inviter_id, SUM(amount) AS amount FROM {self.__table}
+                WHERE status = $1 GROUP BY inviter_id
+            ) ledger ON ledger.inviter_id = {self.__users_table}.id
+            WHERE {self.__users_table}.balance <> COALESCE(ledger.amount, 0)
+            ORDER BY {self.__users_table}.id LIMIT $2
+        """,
+            Bonus.PAID,
+            limit,
+        )
+        return [(drift_data[0], drift_data[1], drift_data[2]) for drift_data in data]
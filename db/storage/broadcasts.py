@@ -0,0 +1,129 @@
+from db.db import DB
+from typing import Dict, List, Tuple
+from datetime import datetime
+from dataclasses import dataclass
+
+
+@dataclass
+class Broadcast:
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+    SENT = "sent"
+    FAILED = "failed"
+    UNREACHABLE = "unreachable"
+
+    id: int
+    text: str
+    created_by: int
+    status: str = RUNNING
+    created_at: datetime = None
+    finished_at: datetime = None
+
+
+class BroadcastStorage:
+    __table = "broadcasts"
+    __deliveries_table = "broadcast_deliveries"
+    __users_table = "users"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def create(self, text: str, created_by: int) -> Broadcast:
+        data = await self._db.fetchrow(
+            f"""
+            INSERT INTO {self.__table} (text, created_by) VALUES ($1, $2)
+            RETURNING id, text, created_by, status, created_at, finished_at
+        """,
+            text,
+            created_by,
+        )
+        return Broadcast(data[0], data[1], data[2], data[3], data[4], data[5])
+
+    async def get_by_id(self, broadcast_id: int) -> Broadcast | None:
+        data = await self._db.fetchrow(
+            f"SELECT id, text, created_by, status, created_at, finished_at FROM {self.__table} WHERE id = $1",
+            broadcast_id,
+        )
+        if data is None:
+            return None
+        return Broadcast(data[0], data[1], data[2], data[3], data[4], data[5])
+
+    async def get_running(self) -> List[Broadcast]:
+        data = await self._db.fetch(
+            f"SELECT id, text, created_by, status, created_at, finished_at FROM {self.__table} WHERE status = $1 ORDER BY id",
+            Broadcast.RUNNING,
+        )
+        return [
+            Broadcast(
+                broadcast_data[0],
+                broadcast_data[1],
+                broadcast_data[2],
+                broadcast_data[3],
+                broadcast_data[4],
+                broadcast_data[5],
+            )
+            for broadcast_data in data
+        ]
+
+    async def get_recipients(
+        self, broadcast_id: int, after_id: int, limit: int
+    ) -> List[int]:
+        data = await self._db.fetch(
+            f"""
+            SELECT u.id FROM {self.__users_table} u
+            WHERE u.id > $2 AND u.role IS DISTINCT FROM 'blocked' AND NOT u.unreachable
+            AND NOT EXISTS (
+                SELECT 1 FROM {self.__deliveries_table} d
+                WHERE d.broadcast_id = $1 AND d.user_id = u.id
+            )
+            ORDER BY u.id LIMIT $3
+        """,
+            broadcast_id,
+            after_id,
+            limit,
+        )
+        return [user_data[0] for user_data in data]
+
+    async def save_deliveries(
+        self, broadcast_id: int, deliveries: List[Tuple[int, str, str | None]]
+    ):
+        unreachable = [
+            user_id
+            for user_id, status, _ in deliveries
+            if status == Broadcast.UNREACHABLE
+        ]
+        async with self._db.transaction() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {self.__deliveries_table} (broadcast_id, user_id, status, error)
+                SELECT $1, user_id, status, error
+                FROM unnest($2::bigint[], $3::text[], $4::text[]) AS delivery (user_id, status, error)
+                ON CONFLICT (broadcast_id, user_id) DO NOTHING
+            """,
+                broadcast_id,
+                [delivery[0] for delivery in deliveries],
+                [delivery[1] for delivery in deliveries],
+                [delivery[2] for delivery in deliveries],
+            )
+            if unreachable:
+                await conn.execute(
+                    f"UPDATE {self.__users_table} SET unreachable = TRUE WHERE id = ANY($1::bigint[])",
+                    unreachable,
+                )
+
+    async def finish(self, broadcast_id: int, status: str = Broadcast.DONE):
+        await self._db.execute(
+            f"UPDATE {self.__table} SET status = $1, finished_at = now() WHERE id = $2 AND status = $3",
+            status,
+            broadcast_id,
+            Broadcast.RUNNING,
+        )
+
+    async def get_stats(self, broadcast_id: int) -> Dict[str, int]:
+        data = await self._db.fetch(
+            f"SELECT status, COUNT(*) FROM {self.__deliveries_table} WHERE broadcast_id = $1 GROUP BY status",
+            broadcast_id,
+        )
+        return {stats_data[0]: stats_data[1] for stats_data in data}
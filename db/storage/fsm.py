@@ -0,0 +1,146 @@
+import copy
+import json
+import typing
+import asyncio
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from db.db import DB
+from utils.cache import LRUCache
+
+
+class FSMStorage(BaseStorage):
+    __table = "fsm_states"
+
+    def __init__(
+        self,
+        db: DB,
+        cache_size: int = 10000,
+        cache_ttl: float | None = 5,
+        chat_affinity: bool = True,
+    ):
+        self._db = db
+        self._cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        self._chat_affinity = chat_affinity
+        self._pending: typing.Dict[typing.Tuple[int, int], dict] = {}
+        self._locks = [asyncio.Lock() for _ in range(64)]
+
+    async def close(self):
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = await self._load(chat, user)
+        return record["state"] or self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None) -> typing.Dict:
+        record = await self._load(chat, user)
+        return copy.deepcopy(record["data"]) or (default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        record = await self._load(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._mark_dirty(chat, user, record)
+
+    async def set_data(self, *, chat=None, user=None, data: typing.Dict = None):
+        record = await self._load(chat, user)
+        record["data"] = copy.deepcopy(data or {})
+        self._mark_dirty(chat, user, record)
+
+    async def update_data(
+        self, *, chat=None, user=None, data: typing.Dict = None, **kwargs
+    ):
+        record = await self._load(chat, user)
+        record["data"].update(copy.deepcopy(data or {}), **kwargs)
+        self._mark_dirty(chat, user, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        record = await self._load(chat, user)
+        record["state"] = None
+        if with_data:
+            record["data"] = {}
+        self._mark_dirty(chat, user, record)
+
+    async def flush(self, *, chat=None, user=None):
+        if chat is None and user is None:
+            await self._write(list(self._pending))
+            return
+        key = self._key(chat, user)
+        async with self._locks[hash(key) % len(self._locks)]:
+            await self._write([key])
+
+    async def _write(self, keys: typing.List[typing.Tuple[int, int]]):
+        pending = {key: self._pending.pop(key) for key in keys if key in self._pending}
+        if not pending:
+            return
+        upserts = [
+            (key, record["state"], json.dumps(record["data"]))
+            for key, record in pending.items()
+            if record["state"] or record["data"]
+        ]
+        deletes = [
+            key
+            for key, record in pending.items()
+            if not (record["state"] or record["data"])
+        ]
+        try:
+            async with self._db.transaction() as conn:
+                if upserts:
+                    await conn.execute(
+                        f"""
+                    INSERT INTO {self.__table} (chat_id, user_id, state, data, updated_at)
+                    SELECT chat_id, user_id, state, data::jsonb, now()
+                    FROM unnest($1::bigint[], $2::bigint[], $3::text[], $4::text[])
+                        AS pending (chat_id, user_id, state, data)
+                    ON CONFLICT (chat_id, user_id) DO UPDATE
+                    SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()
+                """,
+                        [key[0] for key, _, _ in upserts],
+                        [key[1] for key, _, _ in upserts],
+                        [state for _, state, _ in upserts],
+                        [data for _, _, data in upserts],
+                    )
+                if deletes:
+                    await conn.execute(
+                        f"""
+                    DELETE FROM {self.__table}
+                    WHERE (chat_id, user_id) IN (
+                        SELECT * FROM unnest($1::bigint[], $2::bigint[])
+                    )
+                """,
+                        [key[0] for key in deletes],
+                        [key[1] for key in deletes],
+                    )
+        except Exception:
+            for key, record in pending.items():
+                self._pending.setdefault(key, record)
+            raise
+
+    def _key(self, chat, user) -> typing.Tuple[int, int]:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _load(self, chat, user) -> dict:
+        key = self._key(chat, user)
+        record = self._pending.get(key)
+        if record is None and self._chat_affinity:
+            record = self._cache.get(key)
+        if record is None:
+            data = await self._db.fetchrow(
+                f"SELECT state, data FROM {self.__table} WHERE chat_id = $1 AND user_id = $2",
+                key[0],
+                key[1],
+            )
+            if data is None:
+                record = {"state": None, "data": {}}
+            else:
+                record = {"state": data[0], "data": json.loads(data[1])}
+            self._cache.set(key, record)
+        return record
+
+    def _mark_dirty(self, chat, user, record: dict):
+        key = self._key(chat, user)
+        self._cache.set(key, record)
+        self._pending[key] = record
@@ -0,0 +1,25 @@
+from db.db import DB
+from typing import Dict, Tuple
+
+
+class MediaStorage:
+    __table = "media_files"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def get_all(self) -> Dict[str, Tuple[str, str]]:
+        data = await self._db.fetch(f"SELECT name, sha256, file_id FROM {self.__table}")
+        return {media_data[0]: (media_data[1], media_data[2]) for media_data in data}
+
+    async def save(self, name: str, sha256: str, file_id: str):
+        await self._db.execute(
+            f"""
+            INSERT INTO {self.__table} (name, sha256, file_id) VALUES ($1, $2, $3)
+            ON CONFLICT (name) DO UPDATE
+            SET sha256 = EXCLUDED.sha256, file_id = EXCLUDED.file_id, updated_at = now()
+        """,
+            name,
+            sha256,
+            file_id,
+        )
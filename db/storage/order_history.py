@@ -0,0 +1,83 @@
+from db.db import DB
+from typing import List, Tuple
+from datetime import datetime
+from dataclasses import dataclass
+
+
+@dataclass
+class SoldOrder:
+    id: int
+    buyer_id: int
+    link: str
+    size: str
+    price: int
+    yuan_rate: float
+    rub_price: int
+    profit: int
+    bonus: int = 0
+    placed_at: datetime = None
+
+
+class OrderHistoryStorage:
+    __table = "order_history"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def ensure_partitions(self, months_ahead: int = 2) -> List[str]:
+        data = await self._db.fetch(
+            """
+            SELECT create_order_history_partition(now() + make_interval(months => months))
+            FROM generate_series(0, $1) AS months
+        """,
+            months_ahead,
+        )
+        return [partition_data[0] for partition_data in data]
+
+    async def get_by_user(
+        self, user_id: int, limit: int = 20, before: datetime | None = None
+    ) -> List[SoldOrder]:
+        data = await self._db.fetch(
+            f"""
+            SELECT id, buyer_id, link, size, price, yuan_rate, rub_price, profit, bonus, placed_at
+            FROM {self.__table}
+            WHERE buyer_id = $1 AND placed_at < COALESCE($2, 'infinity'::timestamptz)
+            ORDER BY placed_at DESC, id DESC LIMIT $3
+        """,
+            user_id,
+            before,
+            limit,
+        )
+        return [
+            SoldOrder(
+                id=order_data[0],
+                buyer_id=order_data[1],
+                link=order_data[2],
+                size=order_data[3],
+                price=order_data[4],
+                yuan_rate=float(order_data[5]),
+                rub_price=order_data[6],
+                profit=order_data[7],
+                bonus=order_data[8],
+                placed_at=order_data[9],
+            )
+            for order_data in data
+        ]
+
+    async def get_monthly_revenue(
+        self, since: datetime, until: datetime | None = None
+    ) -> List[Tuple[datetime, int, int, int]]:
+        data = await self._db.fetch(
+            f"""
+            SELECT date_trunc('month', placed_at) AS month, COUNT(*), SUM(rub_price), SUM(profit)
+            FROM {self.__table}
+            WHERE placed_at >= $1 AND placed_at < COALESCE($2, 'infinity'::timestamptz)
+            GROUP BY month ORDER BY month
+        """,
+            since,
+            until,
+        )
+        return [
+            (month_data[0], month_data[1], month_data[2], month_data[3])
+            for month_data in data
+        ]
@@ -1,7 +1,29 @@
+import re
+
 from db.db import DB
-from typing import List
+from db.storage.outbox import OutboxStorage
+from utils.pricing import Pricing
+from typing import AsyncIterator, Callable, List, Tuple
 from dataclasses import dataclass
 
+MAX_LINK_LENGTH = 300
+MAX_SIZE_LENGTH = 50
+URL_RE = re.compile(r"https?://\S+")
+
+
+def shorten(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return text[: limit - 1] + "…"
+
+
+def short_link(link: str, limit: int = MAX_LINK_LENGTH) -> str:
+    if len(link) > limit:
+        url = URL_RE.search(link)
+        if url and len(url.group()) <= limit:
+            return url.group()
+    return shorten(link, limit)
+
 
 @dataclass
 class Order:
@@ -11,30 +33,18 @@ class Order:
     size: str = "one size"
     id: int = None
 
-    def custom_str(self, yuan_rate: float) -> str:
-        rub_price = round(1.05 * 1.05 * self.price * yuan_rate + 1000)
-        return f"{self.link}\nРазмер: {self.size}\nЦена в юанях: {self.price}\nЦена в рублях: {rub_price}"
+    def custom_str(self, rub_price: int) -> str:
+        return f"{short_link(self.link)}\nРазмер: {shorten(self.size, MAX_SIZE_LENGTH)}\nЦена в юанях: {self.price}\nЦена в рублях: {rub_price}"
 
 
 class OrderStorage:
     __table = "orders"
+    __counters_table = "counters"
+    __history_table = "order_history"
 
-    def __init__(self, db: DB):
+    def __init__(self, db: DB, outbox: OutboxStorage | None = None):
         self._db = db
-
-    async def init(self):
-        await self._db.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {self.__table} (
-                id SERIAL PRIMARY KEY,
-                buyer_id BIGINT,
-                link TEXT,
-                size TEXT NOT NULL DEFAULT 'one size',
-                price INT,
-                FOREIGN KEY (buyer_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """
-        )
+        self._outbox = outbox
 
     async def get_by_id(self, order_id: int) -> Order | None:
         data = await self._db.fetchrow(
@@ -63,6 +73,43 @@ class OrderStorage:
             for order_data in data
         ]
 
+    async def get_orders_page(
+        self, user_id: int, limit: int, offset: int = 0
+    ) -> Tuple[List[Order], int]:
+        data = await self._db.fetch(
+            f"""
+            SELECT id, buyer_id, link, size, price, COUNT(*) OVER () FROM {self.__table}
+            WHERE buyer_id = $1 ORDER BY id LIMIT $2 OFFSET $3
+        """,
+            user_id,
+            limit,
+            offset,
+        )
+        if not data:
+            return [], await self.get_orders_amount_by_user_id(user_id)
+        return [
+            Order(
+                id=order_data[0],
+                buyer_id=order_data[1],
+                link=order_data[2],
+                size=order_data[3],
+                price=order_data[4],
+            )
+            for order_data in data
+        ], data[0][5]
+
+    async def get_orders_amount_by_user_id(self, user_id: int) -> int:
+        return await self._db.fetchval(
+            f"SELECT COUNT(*) FROM {self.__table} WHERE buyer_id = $1", user_id
+        )
+
+    async def get_cart_totals(self, user_id: int) -> Tuple[int, int]:
+        data = await self._db.fetchrow(
+            f"SELECT COUNT(*), COALESCE(SUM(price), 0) FROM {self.__table} WHERE buyer_id = $1",
+            user_id,
+        )
+        return data[0], data[1]
+
     async def create(self, order: Order):
         await self._db.execute(
             f"""
@@ -93,8 +140,82 @@ class OrderStorage:
             for order_data in data
         ]
 
+    async def iter_members(self, batch_size: int = 1000) -> AsyncIterator[Order]:
+        async for order_data in self._db.iterate(
+            f"SELECT id, buyer_id, link, size, price FROM {self.__table} ORDER BY id",
+            batch_size=batch_size,
+        ):
+            yield Order(
+                id=order_data[0],
+                buyer_id=order_data[1],
+                link=order_data[2],
+                size=order_data[3],
+                price=order_data[4],
+            )
+
+    async def export_csv(self, output) -> int:
+        status = await self._db.copy_from_query(
+            f"SELECT id, buyer_id, link, size, price FROM {self.__table} ORDER BY id",
+            output=output,
+        )
+        return int(status.split()[-1])
+
     async def get_orders_amount(self) -> int:
-        return await self._db.fetchval(f"SELECT COUNT(*) FROM {self.__table}")
+        return await self._db.fetchval(
+            f"SELECT value FROM {self.__counters_table} WHERE name = 'orders_open'"
+        )
+
+    async def checkout(
+        self,
+        user_id: int,
+        pricing: Pricing,
+        yuan_rate: float,
+        event_factory: Callable[[List[Order]], Tuple[str, dict]] | None = None,
+    ) -> List[Order]:
+        async with self._db.transaction() as conn:
+            data = await conn.fetch(
+                f"""
+                DELETE FROM {self.__table} WHERE buyer_id = $1
+                RETURNING id, buyer_id, link, size, price
+            """,
+                user_id,
+            )
+            orders = [
+                Order(
+                    id=order_data[0],
+                    buyer_id=order_data[1],
+                    link=order_data[2],
+                    size=order_data[3],
+                    price=order_data[4],
+                )
+                for order_data in sorted(data, key=lambda order_data: order_data[0])
+            ]
+            if orders:
+                quotes = pricing.quote_many(
+                    [order.price for order in orders], yuan_rate
+                )
+                await conn.execute(
+                    f"""
+                    INSERT INTO {self.__history_table}
+                        (id, buyer_id, link, size, price, yuan_rate, rub_price, profit, bonus)
+                    SELECT id, $1, link, size, price, $2::float8, rub_price, profit, bonus
+                    FROM unnest($3::int[], $4::text[], $5::text[], $6::int[], $7::int[], $8::int[], $9::int[])
+                        AS sold (id, link, size, price, rub_price, profit, bonus)
+                """,
+                    user_id,
+                    yuan_rate,
+                    [order.id for order in orders],
+                    [order.link for order in orders],
+                    [order.size for order in orders],
+                    [order.price for order in orders],
+                    [quote.rub for quote in quotes],
+                    [quote.profit for quote in quotes],
+                    [quote.bonus for quote in quotes],
+                )
+            if orders and event_factory is not None and self._outbox is not None:
+                kind, payload = event_factory(orders)
+                await self._outbox.add(kind, payload, conn)
+        return orders
 
     async def delete(self, order_id: int):
         await self._db.execute(
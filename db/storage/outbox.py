@@ -0,0 +1,123 @@
+import json
+
+import asyncpg
+
+from db.db import DB
+from typing import List, Tuple
+from datetime import datetime
+from dataclasses import dataclass, field
+
+
+@dataclass
+class OutboxEvent:
+    ORDER_PLACED = "order_placed"
+
+    id: int
+    kind: str
+    payload: dict
+    delivered_to: List[int] = field(default_factory=list)
+    attempts: int = 0
+    created_at: datetime = None
+    delivered_parts: List[str] = field(default_factory=list)
+
+
+class OutboxStorage:
+    __table = "outbox"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def add(
+        self, kind: str, payload: dict, conn: asyncpg.Connection | None = None
+    ):
+        await (conn or self._db).execute(
+            f"INSERT INTO {self.__table} (kind, payload) VALUES ($1, $2::jsonb)",
+            kind,
+            json.dumps(payload),
+        )
+
+    async def claim(self, limit: int, lease: float) -> List[OutboxEvent]:
+        data = await self._db.fetch(
+            f"""
+            UPDATE {self.__table}
+            SET attempts = attempts + 1, next_attempt_at = now() + make_interval(secs => $2)
+            WHERE id IN (
+                SELECT id FROM {self.__table}
+                WHERE delivered_at IS NULL AND next_attempt_at <= now()
+                ORDER BY id LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, payload, delivered_to, attempts, created_at, delivered_parts
+        """,
+            limit,
+            lease,
+        )
+        return [
+            OutboxEvent(
+                event_data[0],
+                event_data[1],
+                json.loads(event_data[2]),
+                list(event_data[3]),
+                event_data[4],
+                event_data[5],
+                list(event_data[6]),
+            )
+            for event_data in sorted(data, key=lambda event_data: event_data[0])
+        ]
+
+    async def mark_delivered_to(self, event_id: int, chat_id: int):
+        await self._db.execute(
+            f"""
+            UPDATE {self.__table} SET delivered_to = array_append(delivered_to, $2)
+            WHERE id = $1 AND NOT ($2 = ANY(delivered_to))
+        """,
+            event_id,
+            chat_id,
+        )
+
+    async def mark_part_delivered(self, event_id: int, part: str):
+        await self._db.execute(
+            f"""
+            UPDATE {self.__table} SET delivered_parts = array_append(delivered_parts, $2)
+            WHERE id = $1 AND NOT ($2 = ANY(delivered_parts))
+        """,
+            event_id,
+            part,
+        )
+
+    async def extend_lease(self, event_ids: List[int], lease: float):
+        await self._db.execute(
+            f"""
+            UPDATE {self.__table} SET next_attempt_at = now() + make_interval(secs => $2)
+            WHERE id = ANY($1::bigint[]) AND delivered_at IS NULL
+        """,
+            event_ids,
+            lease,
+        )
+
+    async def complete(self, event_id: int):
+        await self._db.execute(
+            f"UPDATE {self.__table} SET delivered_at = now(), last_error = NULL WHERE id = $1",
+            event_id,
+        )
+
+    async def retry(self, event_id: int, delay: float, error: str):
+        await self._db.execute(
+            f"""
+            UPDATE {self.__table}
+            SET next_attempt_at = now() + make_interval(secs => $2), last_error = $3
+            WHERE id = $1
+        """,
+            event_id,
+            delay,
+            error,
+        )
+
+    async def get_backlog(self) -> Tuple[int, float]:
+        data = await self._db.fetchrow(
+            f"""
+            SELECT COUNT(*), COALESCE(EXTRACT(EPOCH FROM now() - MIN(created_at)), 0)
+            FROM {self.__table} WHERE delivered_at IS NULL
+        """
+        )
+        return data[0], float(data[1])
@@ -0,0 +1,42 @@
+from db.db import DB
+from datetime import datetime
+from dataclasses import dataclass
+
+
+@dataclass
+class Rate:
+    currency: str
+    rate: float
+    fetched_at: datetime
+    etag: str = None
+    last_modified: str = None
+
+
+class RateStorage:
+    __table = "exchange_rates"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def get(self, currency: str) -> Rate | None:
+        data = await self._db.fetchrow(
+            f"SELECT currency, rate, fetched_at, etag, last_modified FROM {self.__table} WHERE currency = $1",
+            currency,
+        )
+        if data is None:
+            return None
+        return Rate(data[0], data[1], data[2], data[3], data[4])
+
+    async def save(self, rate: Rate):
+        await self._db.execute(
+            f"""
+            INSERT INTO {self.__table} (currency, rate, fetched_at, etag, last_modified) VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (currency) DO UPDATE
+            SET rate = EXCLUDED.rate, fetched_at = EXCLUDED.fetched_at, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified
+        """,
+            rate.currency,
+            rate.rate,
+            rate.fetched_at,
+            rate.etag,
+            rate.last_modified,
+        )
@@ -0,0 +1,32 @@
+from db.db import DB
+from typing import Dict
+
+
+class StatsStorage:
+    __table = "counters"
+
+    def __init__(self, db: DB):
+        self._db = db
+
+    async def get_counters(self) -> Dict[str, int]:
+        data = await self._db.fetch(f"SELECT name, value FROM {self.__table}")
+        return {counter_data[0]: counter_data[1] for counter_data in data}
+
+    async def get_counter(self, name: str) -> int:
+        return (
+            await self._db.fetchval(
+                f"SELECT value FROM {self.__table} WHERE name = $1", name
+            )
+            or 0
+        )
+
+    async def set_counters(self, values: Dict[str, int]):
+        await self._db.execute(
+            f"""
+            INSERT INTO {self.__table} (name, value)
+            SELECT * FROM unnest($1::text[], $2::bigint[])
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        """,
+            list(values),
+            list(values.values()),
+        )
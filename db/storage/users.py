@@ -1,6 +1,9 @@
 from db.db import DB
-from typing import List
-from dataclasses import dataclass
+from db.storage.bonuses import Bonus
+from typing import AsyncIterator, List, Set, Tuple
+from dataclasses import dataclass, replace
+
+from utils.cache import LRUCache
 
 
 @dataclass
@@ -16,32 +19,21 @@ class User:
     address: str = None
     balance: int = 0
     inviter_id: int = None
+    unreachable: bool = False
 
 
 class UserStorage:
     __table = "users"
+    __counters_table = "counters"
+    __ledger_table = "bonus_ledger"
 
     def __init__(self, db: DB):
         self._db = db
 
-    async def init(self):
-        await self._db.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {self.__table} (
-                id BIGINT PRIMARY KEY,
-                role TEXT,
-                full_name TEXT DEFAULT NULL,
-                phone TEXT DEFAULT NULL,
-                address TEXT DEFAULT NULL,
-                balance INT NOT NULL DEFAULT 0,
-                inviter_id BIGINT DEFAULT NULL
-            )
-        """
-        )
-
     async def get_by_id(self, user_id: int) -> User | None:
         data = await self._db.fetchrow(
-            f"SELECT * FROM {self.__table} WHERE id = $1", user_id
+            f"SELECT id, role, full_name, phone, address, balance, inviter_id, unreachable FROM {self.__table} WHERE id = $1",
+            user_id,
         )
         if data is None:
             return None
@@ -53,6 +45,43 @@ class UserStorage:
             data[4],
             data[5],
             data[6],
+            data[7],
+        )
+
+    async def bootstrap(
+        self, user_id: int, inviter_id: int | None = None
+    ) -> Tuple[User, bool]:
+        data = await self._db.fetchrow(
+            f"""
+            WITH inserted AS (
+                INSERT INTO {self.__table} (id, role, inviter_id)
+                VALUES ($1, $2, (SELECT id FROM {self.__table} WHERE id = $3 AND id <> $1))
+                ON CONFLICT (id) DO NOTHING
+                RETURNING id, role, full_name, phone, address, balance, inviter_id, unreachable, TRUE
+            )
+            SELECT * FROM inserted
+            UNION ALL
+            SELECT id, role, full_name, phone, address, balance, inviter_id, unreachable, FALSE
+            FROM {self.__table} WHERE id = $1 AND NOT EXISTS (SELECT 1 FROM inserted)
+        """,
+            user_id,
+            User.USER,
+            inviter_id,
+        )
+        if data is None:
+            return await self.get_by_id(user_id), False
+        return (
+            User(
+                data[0],
+                data[1],
+                data[2],
+                data[3],
+                data[4],
+                data[5],
+                data[6],
+                data[7],
+            ),
+            data[8],
         )
 
     async def promote_to_admin(self, id: int):
@@ -90,17 +119,42 @@ class UserStorage:
     async def update(self, user: User):
         await self._db.execute(
             f"""
-            UPDATE {self.__table} SET (role, full_name, phone, address, balance, inviter_id) = ($1, $2, $3, $4, $5, $6) WHERE id = $7
+            UPDATE {self.__table} SET (role, full_name, phone, address, inviter_id) = ($1, $2, $3, $4, $5) WHERE id = $6
         """,
             user.role,
             user.full_name,
             user.phone,
             user.address,
-            user.balance,
             user.inviter_id,
             user.id,
         )
 
+    async def update_contacts(
+        self, user_id: int, full_name: str, phone: str, address: str
+    ) -> User | None:
+        data = await self._db.fetchrow(
+            f"""
+            UPDATE {self.__table} SET (full_name, phone, address) = ($1, $2, $3) WHERE id = $4
+            RETURNING id, role, full_name, phone, address, balance, inviter_id, unreachable
+        """,
+            full_name,
+            phone,
+            address,
+            user_id,
+        )
+        if data is None:
+            return None
+        return User(
+            data[0],
+            data[1],
+            data[2],
+            data[3],
+            data[4],
+            data[5],
+            data[6],
+            data[7],
+        )
+
     async def get_all_members(self) -> List[User] | None:
         data = await self._db.fetch(
             f"""
@@ -122,15 +176,84 @@ class UserStorage:
             for user_data in data
         ]
 
-    async def give_bonus(self, user_id: int, bonus: int):
-        await self._db.execute(
-            f"UPDATE {self.__table} SET balance = balance + $1 WHERE id = $2",
-            bonus,
-            user_id,
+    async def iter_members(self, batch_size: int = 1000) -> AsyncIterator[User]:
+        async for user_data in self._db.iterate(
+            f"SELECT id, role, full_name, phone, address, balance, inviter_id FROM {self.__table} ORDER BY id",
+            batch_size=batch_size,
+        ):
+            yield User(
+                user_data[0],
+                user_data[1],
+                user_data[2],
+                user_data[3],
+                user_data[4],
+                user_data[5],
+                user_data[6],
+            )
+
+    async def export_csv(self, output) -> int:
+        status = await self._db.copy_from_query(
+            f"SELECT id, role, full_name, phone, address, balance, inviter_id FROM {self.__table} ORDER BY id",
+            output=output,
         )
+        return int(status.split()[-1])
+
+    async def upsert_many(self, users: List[User]) -> int:
+        users = list({user.id: user for user in users}.values())
+        async with self._db.transaction() as conn:
+            await conn.execute(
+                f"CREATE TEMP TABLE users_staging (LIKE {self.__table} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            await conn.copy_records_to_table(
+                "users_staging",
+                records=[
+                    (
+                        user.id,
+                        user.role,
+                        user.full_name,
+                        user.phone,
+                        user.address,
+                        user.balance,
+                        user.inviter_id,
+                    )
+                    for user in users
+                ],
+                columns=[
+                    "id",
+                    "role",
+                    "full_name",
+                    "phone",
+                    "address",
+                    "balance",
+                    "inviter_id",
+                ],
+            )
+            await conn.execute(
+                f"""
+                INSERT INTO {self.__ledger_table} (inviter_id, amount, status, paid_at)
+                SELECT users_staging.id, users_staging.balance - COALESCE({self.__table}.balance, 0), $1, now()
+                FROM users_staging LEFT JOIN {self.__table} ON {self.__table}.id = users_staging.id
+                WHERE users_staging.balance <> COALESCE({self.__table}.balance, 0)
+            """,
+                Bonus.PAID,
+            )
+            status = await conn.execute(
+                f"""
+                INSERT INTO {self.__table} (id, role, full_name, phone, address, balance, inviter_id)
+                SELECT id, role, full_name, phone, address, balance, inviter_id FROM users_staging
+                ON CONFLICT (id) DO UPDATE
+                SET (role, full_name, phone, address, balance, inviter_id) = (
+                    EXCLUDED.role, EXCLUDED.full_name, EXCLUDED.phone,
+                    EXCLUDED.address, EXCLUDED.balance, EXCLUDED.inviter_id
+                )
+            """
+            )
+        return int(status.split()[-1])
 
     async def get_user_amount(self) -> int:
-        return await self._db.fetchval(f"SELECT COUNT(*) FROM {self.__table}")
+        return await self._db.fetchval(
+            f"SELECT value FROM {self.__counters_table} WHERE name = 'users_total'"
+        )
 
     async def ban_user(self, user_id: int):
         await self._db.execute(
@@ -142,6 +265,12 @@ class UserStorage:
             f"UPDATE {self.__table} SET role = $1 WHERE id = $2", User.USER, user_id
         )
 
+    async def mark_reachable(self, user_id: int):
+        await self._db.execute(
+            f"UPDATE {self.__table} SET unreachable = FALSE WHERE id = $1 AND unreachable",
+            user_id,
+        )
+
     async def delete(self, user_id: int):
         await self._db.execute(
             f"""
@@ -149,3 +278,121 @@ class UserStorage:
         """,
             user_id,
         )
+
+
+class CachedUserStorage(UserStorage):
+    def __init__(self, db: DB, max_size: int = 10000, ttl: float | None = 300):
+        super().__init__(db)
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+        self._blocked: Set[int] = set()
+
+    def is_blocked(self, user_id: int) -> bool:
+        return user_id in self._blocked
+
+    async def load_blocked(self):
+        self._blocked = set(await self.get_role_list(User.BLOCKED))
+
+    async def get_by_id(self, user_id: int) -> User | None:
+        user = self._cache.get(user_id)
+        if user is None:
+            user = await super().get_by_id(user_id)
+            if user is None:
+                return None
+            self._cache.set(user_id, user)
+        return replace(user)
+
+    async def bootstrap(
+        self, user_id: int, inviter_id: int | None = None
+    ) -> Tuple[User, bool]:
+        user = self._cache.get(user_id)
+        if user is not None:
+            return replace(user), False
+        user, is_new = await super().bootstrap(user_id, inviter_id)
+        self._cache.set(user_id, user)
+        self._track_role(user_id, user.role)
+        return replace(user), is_new
+
+    async def create(self, user: User):
+        await super().create(user)
+        self._cache.set(user.id, replace(user))
+        self._track_role(user.id, user.role)
+
+    async def update(self, user: User):
+        await super().update(user)
+        self._cache.set(user.id, replace(user))
+        self._track_role(user.id, user.role)
+
+    async def update_contacts(
+        self, user_id: int, full_name: str, phone: str, address: str
+    ) -> User | None:
+        user = await super().update_contacts(user_id, full_name, phone, address)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+        self._cache.set(user_id, user)
+        self._track_role(user_id, user.role)
+        return replace(user)
+
+    async def promote_to_admin(self, id: int):
+        await super().promote_to_admin(id)
+        self._set_role(id, User.ADMIN)
+
+    async def demote_from_admin(self, id: int):
+        await super().demote_from_admin(id)
+        self._set_role(id, User.USER)
+
+    async def ban_user(self, user_id: int):
+        await super().ban_user(user_id)
+        self._set_role(user_id, User.BLOCKED)
+
+    async def unban_user(self, user_id: int):
+        await super().unban_user(user_id)
+        self._set_role(user_id, User.USER)
+
+    async def upsert_many(self, users: List[User]) -> int:
+        count = await super().upsert_many(users)
+        self.invalidate(*(user.id for user in users))
+        for user in users:
+            self._track_role(user.id, user.role)
+        return count
+
+    async def mark_reachable(self, user_id: int):
+        await super().mark_reachable(user_id)
+        user = self._cache.pop(user_id)
+        if user is not None:
+            self._cache.set(user_id, replace(user, unreachable=False))
+
+    async def delete(self, user_id: int):
+        await super().delete(user_id)
+        self.invalidate(user_id)
+        self._blocked.discard(user_id)
+
+    def invalidate(self, *user_ids: int):
+        for user_id in user_ids:
+            self._cache.pop(user_id)
+
+    def render_metrics(self) -> List[str]:
+        stats = self._cache.stats()
+        return [
+            f"user_cache_size {stats['size']}",
+            f"user_cache_hits_total {stats['hits']}",
+            f"user_cache_misses_total {stats['misses']}",
+            f"user_cache_evictions_total {stats['evictions']}",
+            f"user_blocked_ids {len(self._blocked)}",
+        ]
+
+    def report(self) -> str:
+        stats = self._cache.stats()
+        return f"User cache: {stats['size']}/{stats['max_size']}, hits {stats['hits']}, misses {stats['misses']}, hit ratio {stats['hit_ratio']:.1%}"
+
+    def _set_role(self, user_id: int, role: str):
+        user = self._cache.pop(user_id)
+        if user is not None:
+            self._cache.set(user_id, replace(user, role=role))
+        self._track_role(user_id, role)
+
+    def _track_role(self, user_id: int, role: str):
+        if role == User.BLOCKED:
+            self._blocked.add(user_id)
+        else:
+            self._blocked.discard(user_id)
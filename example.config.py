@@ -5,3 +5,47 @@ class Config:
     LOGIN=
     PASSWORD=
     DATABASE=
+    ADMIN_IDS=[6632311175]
+    USER_CACHE_SIZE=10000
+    USER_CACHE_TTL=300
+    TG_GLOBAL_RATE=30
+    TG_CHAT_RATE=1
+    TG_SEND_CONCURRENCY=8
+    RUN_MODE="polling"
+    SHARD_WORKERS=
+    SHARD_HEALTH_INTERVAL=5
+    SHARD_HEALTH_TIMEOUT=30
+    WEBHOOK_URL=
+    WEBHOOK_PATH="/webhook"
+    WEBHOOK_SECRET=
+    WEBAPP_HOST="0.0.0.0"
+    WEBAPP_PORT=8080
+    WEBHOOK_MAX_CONCURRENCY=256
+    TELEGRAM_API_SERVER=
+    FSM_CACHE_TTL=5
+    FSM_CHAT_AFFINITY=True
+    RATE_SOURCE_URL="https://www.cbr-xml-daily.ru/latest.js"
+    RATE_MAX_AGE=60
+    STATIC_YUAN_RATE=
+    STATIC_DIR="static"
+    DB_POOL_MIN_SIZE=1
+    DB_POOL_MAX_SIZE=10
+    DB_POOL_WARM_UP=4
+    DB_STATEMENT_CACHE_SIZE=1024
+    DB_COMMAND_TIMEOUT=
+    DB_MAX_INACTIVE_CONNECTION_LIFETIME=300
+    DB_MAX_QUERIES=50000
+    DB_SLOW_QUERY_THRESHOLD=0.5
+    METRICS_HOST="0.0.0.0"
+    METRICS_PORT=
+    BROADCAST_RATE=20
+    BROADCAST_CONCURRENCY=8
+    BROADCAST_BATCH_SIZE=100
+    PRICE_COMMISSION=0.05
+    PRICE_MARKUP=0.05
+    PRICE_FIXED_FEE=1000
+    REFERRAL_SHARE=0.2
+    BONUS_PAYOUT_INTERVAL=60
+    ANTIFLOOD_RATE=2
+    ANTIFLOOD_BURST=10
+    OUTBOX_POLL_INTERVAL=1
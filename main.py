@@ -1,34 +1,187 @@
+import os
+import sys
+import signal
 import asyncio
+import logging
+import argparse
 
-from db.db import DB
+import aiogram
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+
+from db.db import make_db
+from db.migrations import Migrator
 from bot.bot import TG_Bot
-from db.storage import UserStorage, OrderStorage
+from bot.media import MediaRegistry
+from bot.shard import ShardFront, ShardWorker
+from db.storage import (
+    CachedUserStorage,
+    OrderStorage,
+    FSMStorage,
+    RateStorage,
+    MediaStorage,
+    BroadcastStorage,
+    BonusStorage,
+    StatsStorage,
+    OutboxStorage,
+    OrderHistoryStorage,
+)
+from utils.metrics import METRICS
+from utils.rates import CBR_URL, CbrRateSource, RateProvider, StaticRateSource
+from utils.startup import Startup
 from config import Config
 
 
-async def init_db():
-    db = DB(
-        host=Config.HOST,
-        port=Config.PORT,
-        login=Config.LOGIN,
-        password=Config.PASSWORD,
-        database=Config.DATABASE,
+async def init_db(startup: Startup | None = None):
+    startup = startup or Startup()
+    db = make_db()
+    await startup.run("db_pool", db.init())
+    METRICS.register("db", db.render_metrics, db.report)
+    await asyncio.gather(
+        startup.run("migrations", Migrator(db).run()),
+        startup.run("db_warm_up", db.warm_up(getattr(Config, "DB_POOL_WARM_UP", 4))),
+    )
+    user_storage = CachedUserStorage(
+        db,
+        max_size=getattr(Config, "USER_CACHE_SIZE", 10000),
+        ttl=getattr(Config, "USER_CACHE_TTL", 300),
+    )
+    fsm_storage = FSMStorage(
+        db,
+        cache_ttl=getattr(Config, "FSM_CACHE_TTL", 5),
+        chat_affinity=getattr(Config, "FSM_CHAT_AFFINITY", True),
+    )
+    rate_storage = RateStorage(db)
+    media_storage = MediaStorage(db)
+    broadcast_storage = BroadcastStorage(db)
+    bonus_storage = BonusStorage(db)
+    stats_storage = StatsStorage(db)
+    outbox_storage = OutboxStorage(db)
+    order_storage = OrderStorage(db, outbox_storage)
+    order_history_storage = OrderHistoryStorage(db)
+    return (
+        db,
+        user_storage,
+        order_storage,
+        fsm_storage,
+        rate_storage,
+        media_storage,
+        broadcast_storage,
+        bonus_storage,
+        stats_storage,
+        outbox_storage,
+        order_history_storage,
+    )
+
+
+def make_rate_provider(rate_storage: RateStorage) -> RateProvider:
+    if getattr(Config, "STATIC_YUAN_RATE", None):
+        source = StaticRateSource(Config.STATIC_YUAN_RATE)
+    else:
+        source = CbrRateSource(getattr(Config, "RATE_SOURCE_URL", None) or CBR_URL)
+    return RateProvider(
+        rate_storage, source, max_age=getattr(Config, "RATE_MAX_AGE", 60)
     )
-    await db.init()
-    user_storage = UserStorage(db)
-    await user_storage.init()
-    order_storage = OrderStorage(db)
-    await order_storage.init()
-    return user_storage, order_storage
 
 
-async def main():
-    user_storage, order_storage = await init_db()
-    tg_bot = TG_Bot(user_storage, order_storage)
-    await tg_bot.init()
-    await tg_bot.start()
+def shard_command(index: int, shards: int):
+    return [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--shard",
+        str(index),
+        "--shards",
+        str(shards),
+    ]
+
+
+async def run_front():
+    api_server = TELEGRAM_PRODUCTION
+    if getattr(Config, "TELEGRAM_API_SERVER", None):
+        api_server = TelegramAPIServer.from_base(Config.TELEGRAM_API_SERVER)
+    bot = aiogram.Bot(token=Config.TGBOT_API_KEY, server=api_server)
+    front = ShardFront(
+        bot,
+        shard_command,
+        getattr(Config, "SHARD_WORKERS", None) or os.cpu_count() or 1,
+        health_interval=getattr(Config, "SHARD_HEALTH_INTERVAL", 5),
+        health_timeout=getattr(Config, "SHARD_HEALTH_TIMEOUT", 30),
+    )
+    METRICS.register("shards", front.render_metrics, front.report)
+    if getattr(Config, "METRICS_PORT", None):
+        await METRICS.start_server(
+            getattr(Config, "METRICS_HOST", "0.0.0.0"), Config.METRICS_PORT
+        )
+    try:
+        await front.run()
+    finally:
+        session = await bot.get_session()
+        await session.close()
+
+
+async def main(shard: int | None = None, shards: int = 1):
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    if shard is None and getattr(Config, "RUN_MODE", "polling") == "sharded":
+        await run_front()
+        return
+    worker = None
+    if shard is not None:
+        Config.TG_GLOBAL_RATE = getattr(Config, "TG_GLOBAL_RATE", 30) / shards
+        Config.METRICS_PORT = None
+        worker = ShardWorker()
+        await worker.open()
+    startup = Startup()
+    METRICS.register("startup", startup.render_metrics, startup.report)
+    (
+        db,
+        user_storage,
+        order_storage,
+        fsm_storage,
+        rate_storage,
+        media_storage,
+        broadcast_storage,
+        bonus_storage,
+        stats_storage,
+        outbox_storage,
+        order_history_storage,
+    ) = await init_db(startup)
+    tg_bot = TG_Bot(
+        user_storage,
+        order_storage,
+        make_rate_provider(rate_storage),
+        MediaRegistry(media_storage, getattr(Config, "STATIC_DIR", "static")),
+        broadcast_storage,
+        bonus_storage,
+        stats_storage,
+        outbox_storage,
+        order_history_storage,
+        fsm_storage,
+    )
+    try:
+        await tg_bot.init(startup, primary=not shard)
+        if worker is None:
+            await tg_bot.start()
+        else:
+            await tg_bot.wait_ready()
+            await worker.serve(tg_bot.dispatcher)
+    finally:
+        await tg_bot.stop()
+        await db.close()
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard", type=int, default=None)
+    parser.add_argument("--shards", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+        if args.shard is None
+        else f"%(asctime)s %(levelname)s [shard {args.shard}] %(name)s: %(message)s",
+    )
+    try:
+        asyncio.run(main(args.shard, args.shards))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
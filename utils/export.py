@@ -0,0 +1,17 @@
+import gzip
+import typing
+
+
+async def export_to_file(
+    export: typing.Callable[[typing.Any], typing.Awaitable[int]],
+    path: str,
+    compress: bool = False,
+) -> int:
+    if not compress:
+        return await export(path)
+    with gzip.open(path, "wb") as file:
+
+        async def write(chunk: bytes):
+            file.write(chunk)
+
+        return await export(write)
@@ -0,0 +1,180 @@
+import os
+import csv
+import json
+import time
+import typing
+import asyncio
+import logging
+import argparse
+
+from db.db import make_db
+from db.migrations import Migrator
+from db.storage import User, UserStorage
+
+logger = logging.getLogger(__name__)
+
+ROLES = (User.USER, User.ADMIN, User.BLOCKED)
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+ADDRESS_FIELDS = ("city", "street", "house", "building", "apartament")
+
+
+def make_address(row: dict) -> str | None:
+    if not row.get("city") and not row.get("street"):
+        return row.get("address") or None
+    parts = [row.get(field) for field in ADDRESS_FIELDS]
+    missing = [
+        field for field, part in zip(ADDRESS_FIELDS, parts) if not isinstance(part, str)
+    ]
+    if missing:
+        raise InvalidRow(f"missing address fields: {', '.join(missing)}")
+    city, street, house, building, apartament = parts
+    return (
+        city
+        + " "
+        + street
+        + " дом "
+        + house
+        + " строение "
+        + building
+        + " квартира "
+        + apartament
+    )
+
+
+def parse_int(
+    value: str | None, field: str, default: int | None = None, required=False
+) -> int | None:
+    value = (value or "").strip()
+    if not value:
+        if required:
+            raise InvalidRow(f"missing {field}")
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRow(f"{field} is not an integer: {value!r}")
+
+
+def parse_row(row: dict) -> User:
+    role = (row.get("role") or "").strip() or User.USER
+    if role not in ROLES:
+        raise InvalidRow(f"unknown role: {role!r}")
+    return User(
+        id=parse_int(row.get("id"), "id", required=True),
+        role=role,
+        full_name=(row.get("full_name") or "").strip() or None,
+        phone=(row.get("phone") or "").strip() or None,
+        address=make_address(row),
+        balance=parse_int(row.get("balance"), "balance", 0),
+        inviter_id=parse_int(row.get("inviter_id"), "inviter_id"),
+    )
+
+
+class Checkpoint:
+    def __init__(self, path: str, source: str):
+        self._path = path
+        self._source = os.path.abspath(source)
+        self._size = os.path.getsize(source)
+
+    def load(self) -> int:
+        try:
+            with open(self._path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return 0
+        if data.get("source") != self._source or data.get("size") != self._size:
+            logger.warning("Checkpoint %s is for another file, ignoring", self._path)
+            return 0
+        return data["rows"]
+
+    def save(self, rows: int):
+        with open(self._path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"source": self._source, "size": self._size, "rows": rows}, file)
+        os.replace(self._path + ".tmp", self._path)
+
+    def clear(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def read_batches(
+    path: str, skip: int, batch_size: int
+) -> typing.Iterator[typing.Tuple[int, typing.List[User], int]]:
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        batch, invalid, rows = [], 0, 0
+        for rows, row in enumerate(csv.DictReader(file), start=1):
+            if rows <= skip:
+                continue
+            try:
+                batch.append(parse_row(row))
+            except InvalidRow as error:
+                invalid += 1
+                logger.warning("Skipping row %s: %s", rows, error)
+            if len(batch) >= batch_size:
+                yield rows, batch, invalid
+                batch, invalid = [], 0
+        if batch or invalid:
+            yield rows, batch, invalid
+
+
+async def import_users(
+    user_storage: UserStorage,
+    path: str,
+    checkpoint: Checkpoint,
+    batch_size: int = 5000,
+) -> typing.Dict[str, int]:
+    skip = checkpoint.load()
+    if skip:
+        logger.info("Resuming %s after row %s", path, skip)
+    stats = {"rows": skip, "imported": 0, "invalid": 0}
+    started_at = time.perf_counter()
+    for rows, batch, invalid in read_batches(path, skip, batch_size):
+        if batch:
+            stats["imported"] += await user_storage.upsert_many(batch)
+        stats["invalid"] += invalid
+        stats["rows"] = rows
+        checkpoint.save(rows)
+        logger.info(
+            "Imported %s rows (%.0f rows/s)",
+            rows,
+            (rows - skip) / (time.perf_counter() - started_at),
+        )
+    checkpoint.clear()
+    return stats
+
+
+async def main(args: argparse.Namespace):
+    db = make_db()
+    await db.init()
+    try:
+        await Migrator(db).run()
+        stats = await import_users(
+            UserStorage(db),
+            args.path,
+            Checkpoint(args.checkpoint or args.path + ".checkpoint", args.path),
+            args.batch_size,
+        )
+    finally:
+        await db.close()
+    logger.info(
+        "Done: %s rows read, %s upserted, %s invalid",
+        stats["rows"],
+        stats["imported"],
+        stats["invalid"],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import legacy users from CSV")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--checkpoint", default=None)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,146 @@
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+_collected_time: ContextVar[Dict[str, float] | None] = ContextVar(
+    "collected_time", default=None
+)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self._counts[bisect.bisect_left(self._buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self._buckets[index - 1] if index else 0.0
+                upper = self._buckets[index] if index < len(self._buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+    def render(self, name: str, labels: Dict[str, str] | None = None) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bucket, bucket_count in zip(self._buckets + ("+Inf",), self._counts):
+            cumulative += bucket_count
+            bucket_labels = dict(labels or {}, le=str(bucket))
+            lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+def format_labels(labels: Dict[str, str] | None) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        key
+        + '="'
+        + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+@contextmanager
+def collect_time() -> Iterator[Dict[str, float]]:
+    timings: Dict[str, float] = {}
+    token = _collected_time.set(timings)
+    try:
+        yield timings
+    finally:
+        _collected_time.reset(token)
+
+
+def track_time(component: str, seconds: float):
+    timings = _collected_time.get()
+    if timings is not None:
+        timings[component] = timings.get(component, 0.0) + seconds
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._collectors: Dict[
+            str, Tuple[Callable[[], List[str]] | None, Callable[[], str] | None]
+        ] = {}
+
+    def register(
+        self,
+        name: str,
+        render: Callable[[], List[str]] | None = None,
+        report: Callable[[], str] | None = None,
+    ):
+        self._collectors[name] = (render, report)
+
+    def render(self) -> str:
+        lines = []
+        for render, _ in self._collectors.values():
+            if render is not None:
+                lines.extend(render())
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        return "\n\n".join(
+            report() for _, report in self._collectors.values() if report is not None
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain")
+
+    async def start_server(self, host: str, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,82 @@
+import typing
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_decimal(value: float | int | str | Decimal) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def round_rub(value: Decimal) -> int:
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+@dataclass(frozen=True)
+class Quote:
+    yuan: int
+    rub: int
+    profit: int
+    bonus: int
+
+
+@dataclass(frozen=True)
+class CartQuote:
+    items: typing.List[Quote]
+    yuan: int
+    rub: int
+    profit: int
+
+
+class Pricing:
+    def __init__(
+        self,
+        commission: float = 0.05,
+        markup: float = 0.05,
+        fixed_fee: int = 1000,
+        referral_share: float = 0.2,
+    ):
+        self._commission = to_decimal(commission)
+        self._markup = to_decimal(markup)
+        self._fixed_fee = to_decimal(fixed_fee)
+        self._referral_share = to_decimal(referral_share)
+
+    def quote(self, yuan: int, yuan_rate: float) -> Quote:
+        return self.quote_many([yuan], yuan_rate)[0]
+
+    def quote_many(
+        self, prices: typing.Iterable[int], yuan_rate: float
+    ) -> typing.List[Quote]:
+        base_rate = to_decimal(yuan_rate) * (1 + self._commission)
+        quotes = []
+        for yuan in prices:
+            base = yuan * base_rate
+            profit = base * self._markup
+            quotes.append(
+                Quote(
+                    yuan=yuan,
+                    rub=round_rub(base + profit + self._fixed_fee),
+                    profit=round_rub(profit),
+                    bonus=round_rub(profit * self._referral_share),
+                )
+            )
+        return quotes
+
+    def quote_cart(self, prices: typing.Iterable[int], yuan_rate: float) -> CartQuote:
+        prices = list(prices)
+        total_yuan = sum(prices)
+        return CartQuote(
+            items=self.quote_many(prices, yuan_rate),
+            yuan=total_yuan,
+            rub=self.total_rub(len(prices), total_yuan, yuan_rate),
+            profit=self.total_profit(total_yuan, yuan_rate),
+        )
+
+    def total_rub(self, amount: int, total_yuan: int, yuan_rate: float) -> int:
+        base = total_yuan * to_decimal(yuan_rate) * (1 + self._commission)
+        return round_rub(base * (1 + self._markup) + amount * self._fixed_fee)
+
+    def total_profit(self, total_yuan: int, yuan_rate: float) -> int:
+        base = total_yuan * to_decimal(yuan_rate) * (1 + self._commission)
+        return round_rub(base * self._markup)
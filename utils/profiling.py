@@ -0,0 +1,122 @@
+import io
+import time
+import pstats
+import typing
+import asyncio
+import cProfile
+import functools
+from collections import Counter, defaultdict
+
+from aiogram.dispatcher.handler import CancelHandler, SkipHandler
+
+from utils.metrics import LatencyHistogram, collect_time, format_labels
+
+COMPONENTS = ("telegram", "db")
+
+
+def handler_name(handler: typing.Callable) -> str:
+    while hasattr(handler, "__wrapped__"):
+        handler = handler.__wrapped__
+    return getattr(handler, "__name__", repr(handler))
+
+
+class HandlerMetrics:
+    def __init__(self):
+        self._wall: typing.Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._components = {
+            component: defaultdict(LatencyHistogram) for component in COMPONENTS
+        }
+        self.errors = Counter()
+
+    def wrap(self, handler: typing.Callable) -> typing.Callable:
+        name = handler_name(handler)
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            with collect_time() as timings:
+                try:
+                    return await handler(*args, **kwargs)
+                except (CancelHandler, SkipHandler):
+                    raise
+                except Exception:
+                    self.errors[name] += 1
+                    raise
+                finally:
+                    self._wall[name].observe(time.perf_counter() - started_at)
+                    for component in COMPONENTS:
+                        self._components[component][name].observe(
+                            timings.get(component, 0.0)
+                        )
+
+        return wrapper
+
+    def render_metrics(self) -> typing.List[str]:
+        lines = []
+        for name, wall in self._wall.items():
+            labels = {"handler": name}
+            lines.extend(wall.render("handler_duration_seconds", labels))
+            for component in COMPONENTS:
+                lines.extend(
+                    self._components[component][name].render(
+                        f"handler_{component}_seconds", labels
+                    )
+                )
+            lines.append(
+                f"handler_errors_total{format_labels(labels)} {self.errors[name]}"
+            )
+        return lines
+
+    def report(self, limit: int = 15) -> str:
+        lines = ["Handlers: calls / p50 / p95 ms / telegram p95 / db p95 / errors"]
+        by_total = sorted(self._wall.items(), key=lambda item: -item[1].sum)
+        for name, wall in by_total[:limit]:
+            telegram = self._components["telegram"][name]
+            db = self._components["db"][name]
+            lines.append(
+                f"{name}: {wall.count} / {wall.quantile(0.5) * 1000:.1f} / "
+                f"{wall.quantile(0.95) * 1000:.1f} / "
+                f"{telegram.quantile(0.95) * 1000:.1f} / "
+                f"{db.quantile(0.95) * 1000:.1f} / {self.errors[name]}"
+            )
+        return "\n".join(lines)
+
+
+class Profiler:
+    SORT_KEYS = ("tottime", "cumulative", "ncalls")
+
+    def __init__(self, max_seconds: float = 300):
+        self.max_seconds = max_seconds
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def capture(
+        self, seconds: float, sort: str = "tottime", limit: int = 25
+    ) -> str:
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"unknown sort key: {sort}")
+        seconds = min(max(seconds, 1), self.max_seconds)
+        async with self._lock:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output).strip_dirs()
+        stats.sort_stats(sort).print_stats(limit)
+        return self._format(output.getvalue())
+
+    @staticmethod
+    def _format(text: str) -> str:
+        lines = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith(("Ordered by", "List reduced")):
+                continue
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,40 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+
+    def delay(self, tokens: float = 1) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self._rate
+
+    def consume(self, tokens: float = 1) -> bool:
+        if self.delay(tokens) > 0:
+            return False
+        self._tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1):
+        while not self.consume(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    def block(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated_at) * self._rate
+        )
+        self._updated_at = now
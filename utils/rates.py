@@ -0,0 +1,126 @@
+import time
+import asyncio
+import logging
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import aiohttp
+
+from db.storage import Rate, RateStorage
+
+logger = logging.getLogger(__name__)
+
+CBR_URL = "https://www.cbr-xml-daily.ru/latest.js"
+
+
+class RateSource:
+    async def fetch(self, currency: str, previous: Rate | None) -> Rate:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StaticRateSource(RateSource):
+    def __init__(self, rate: float):
+        self._rate = rate
+
+    async def fetch(self, currency: str, previous: Rate | None) -> Rate:
+        return Rate(currency, self._rate, datetime.now(timezone.utc))
+
+
+class CbrRateSource(RateSource):
+    def __init__(self, url: str = CBR_URL, timeout: float = 10):
+        self._url = url
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def fetch(self, currency: str, previous: Rate | None) -> Rate:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+        headers = {}
+        if previous is not None and previous.etag:
+            headers["If-None-Match"] = previous.etag
+        if previous is not None and previous.last_modified:
+            headers["If-Modified-Since"] = previous.last_modified
+        async with self._session.get(self._url, headers=headers) as response:
+            now = datetime.now(timezone.utc)
+            if response.status == 304 and previous is not None:
+                return replace(previous, fetched_at=now)
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+            return Rate(
+                currency,
+                1 / data["rates"][currency],
+                now,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class RateProvider:
+    def __init__(
+        self,
+        storage: RateStorage,
+        source: RateSource,
+        currency: str = "CNY",
+        max_age: float = 60,
+        retry_delay: float = 10,
+    ):
+        self._storage = storage
+        self._source = source
+        self._currency = currency
+        self._max_age = max_age
+        self._retry_delay = retry_delay
+        self._retry_at = 0.0
+        self._current: Rate | None = None
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def rate(self) -> float | None:
+        if self.is_stale and time.monotonic() >= self._retry_at:
+            self.refresh_in_background()
+        return self._current.rate if self._current else None
+
+    @property
+    def is_stale(self) -> bool:
+        if self._current is None:
+            return True
+        age = datetime.now(timezone.utc) - self._current.fetched_at
+        return age.total_seconds() > self._max_age
+
+    async def init(self):
+        self._current = await self._storage.get(self._currency)
+        if self._current is not None:
+            self.refresh_in_background()
+            return
+        delay = 1
+        while not await self.refresh():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    async def refresh(self) -> bool:
+        try:
+            rate = await self._source.fetch(self._currency, self._current)
+        except Exception as e:
+            logger.warning("Failed to fetch %s rate: %r", self._currency, e)
+            self._retry_at = time.monotonic() + self._retry_delay
+            return False
+        self._current = rate
+        try:
+            await self._storage.save(rate)
+        except Exception:
+            logger.exception("Failed to persist %s rate", self._currency)
+        return True
+
+    def refresh_in_background(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def close(self):
+        await self._source.close()
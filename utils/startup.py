@@ -0,0 +1,57 @@
+import time
+import typing
+import logging
+
+from utils.metrics import format_labels
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class Startup:
+    def __init__(self):
+        self._started_at = time.perf_counter()
+        self._ready_at: float | None = None
+        self.phases: typing.Dict[str, typing.Tuple[float, float]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._ready_at is not None
+
+    async def run(self, name: str, awaitable: typing.Awaitable[T]) -> T:
+        started_at = time.perf_counter() - self._started_at
+        try:
+            return await awaitable
+        finally:
+            finished_at = time.perf_counter() - self._started_at
+            self.phases[name] = (started_at, finished_at - started_at)
+            logger.info(
+                "Startup phase %s took %.0f ms",
+                name,
+                (finished_at - started_at) * 1000,
+            )
+
+    def finish(self):
+        self._ready_at = time.perf_counter() - self._started_at
+        logger.info(self.report())
+
+    def render_metrics(self) -> typing.List[str]:
+        lines = [
+            f"startup_phase_seconds{format_labels({'phase': name})} {duration}"
+            for name, (_, duration) in self.phases.items()
+        ]
+        if self._ready_at is not None:
+            lines.append(f"startup_ready_seconds {self._ready_at}")
+        return lines
+
+    def report(self) -> str:
+        phases = ", ".join(
+            f"{name} {duration * 1000:.0f} ms (+{started_at * 1000:.0f})"
+            for name, (started_at, duration) in sorted(
+                self.phases.items(), key=lambda item: item[1][0]
+            )
+        )
+        if self._ready_at is None:
+            return f"Startup: in progress, {phases}"
+        return f"Startup: ready in {self._ready_at * 1000:.0f} ms, {phases}"